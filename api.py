@@ -0,0 +1,242 @@
+# electronic_library/api.py
+# JSON API.
+# POST /api/views — приём просмотров книг (beacon): страница книги отправляет событие
+# через navigator.sendBeacon, ответ возвращается сразу, а запись в page_views и свёртку выполняет
+# фоновый поток tracking.recorder пачками. Лимит MAX_VIEWS_PER_DAY проверяется так же, как в view_book.
+# GET /api/books, /api/books/<id>, /api/books/<id>/reviews — каталог только для чтения: фильтры
+# BookSearchForm, выбор полей (?fields=id,title — в SELECT попадают только нужные колонки),
+# keyset-пагинация (after/before) и слабые ETag по books.version для дешёвой перепроверки (304).
+
+import datetime
+import hashlib
+import json
+
+from flask import request, jsonify, url_for, abort, make_response
+from flask_login import current_user
+from sqlalchemy import select
+
+from extensions import db
+from app import app
+from models import Book, Cover, Genre, Review, User, book_genres
+from forms import BookSearchForm
+import covers
+import search
+import tracking
+from pagination import keyset_paginate
+from ratelimit import view_limiter
+from replica import replica_reads
+
+
+def parse_view_events(payload):
+    """Список ID книг из {"book_id": 1}, {"events": [{"book_id": 1}, ...]} или [{"book_id": 1}, ...].
+
+    Возвращает None, если тело не соответствует ни одному из форматов.
+    """
+    if isinstance(payload, dict):
+        payload = payload.get('events', [payload])
+    if not isinstance(payload, list):
+        return None
+    book_ids = []
+    for event in payload:
+        if not isinstance(event, dict) or isinstance(event.get('book_id'), bool):
+            return None
+        try:
+            book_ids.append(int(event['book_id']))
+        except (KeyError, TypeError, ValueError):
+            return None
+    return book_ids
+
+
+@app.route('/api/views', methods=['POST'])
+def api_views():
+    # sendBeacon отправляет строку с Content-Type text/plain, поэтому JSON разбирается без проверки заголовка
+    book_ids = parse_view_events(request.get_json(force=True, silent=True))
+    if not book_ids:
+        return jsonify({'error': 'Ожидается {"book_id": ...} или {"events": [{"book_id": ...}, ...]}.'}), 400
+    if len(book_ids) > app.config['API_VIEWS_MAX_BATCH']:
+        return jsonify({'error': f"Не больше {app.config['API_VIEWS_MAX_BATCH']} событий за запрос."}), 413
+
+    # Время просмотра — серверное: часам клиента нельзя доверять ни для статистики, ни для лимита
+    now = datetime.datetime.now(datetime.timezone.utc)
+    viewer_id = current_user.id if current_user.is_authenticated else None
+    user_ip = request.remote_addr
+    existing = set(db.session.scalars(select(Book.id).where(Book.id.in_(set(book_ids)))))
+    accepted = 0
+    for book_id in book_ids:
+        if book_id in existing and view_limiter.hit(book_id, viewer_id, user_ip, now):
+            tracking.recorder.enqueue(book_id, viewer_id, user_ip, now)
+            accepted += 1
+    return jsonify({'accepted': accepted, 'rejected': len(book_ids) - accepted}), 202
+
+
+# --- Каталог ---
+
+def _column(column):
+    return (column,), lambda row: getattr(row, column.key)
+
+
+def _average_rating(row):
+    return round(row.rating_sum / row.review_count, 1) if row.review_count else 0.0
+
+
+def _cover_url(row):
+    # В строке есть filename и md5_hash обложки — этого достаточно для covers.cover_url
+    return covers.cover_url(row) if row.filename else None
+
+
+# Поле ответа -> (колонки для SELECT, значение из строки результата). Жанры выбираются отдельным запросом
+BOOK_FIELDS = {
+    'id': _column(Book.id),
+    'title': _column(Book.title),
+    'author': _column(Book.author),
+    'publisher': _column(Book.publisher),
+    'publication_year': _column(Book.publication_year),
+    'pages': _column(Book.pages),
+    'short_description': _column(Book.short_description),
+    'review_count': _column(Book.review_count),
+    'average_rating': ((Book.review_count, Book.rating_sum), _average_rating),
+    'cover_url': ((Cover.filename, Cover.md5_hash), _cover_url),
+    'genres': ((), None),
+    'version': _column(Book.version),
+}
+# В списке по умолчанию нет описания: это самая тяжёлая колонка, а карточке каталога она не нужна
+LIST_FIELDS = [name for name in BOOK_FIELDS if name != 'short_description']
+DETAIL_FIELDS = list(BOOK_FIELDS)
+
+
+def api_error(message, status=400):
+    abort(make_response(jsonify({'error': message}), status))
+
+
+def requested_fields(default):
+    raw = request.args.get('fields')
+    if not raw:
+        return default
+    fields = list(dict.fromkeys(name.strip() for name in raw.split(',') if name.strip()))
+    unknown = [name for name in fields if name not in BOOK_FIELDS]
+    if unknown or not fields:
+        api_error(f"Неизвестные поля: {', '.join(unknown) or '—'}. Доступны: {', '.join(BOOK_FIELDS)}.")
+    return fields
+
+
+def page_size():
+    per_page = request.args.get('per_page', app.config['PAGINATION_PER_PAGE'], type=int)
+    return min(max(per_page, 1), app.config['API_MAX_PER_PAGE'])
+
+
+def book_query(fields, *required):
+    """Запрос только колонок, нужных для fields (и служебных required), без загрузки объектов Book."""
+    columns = [Book.id, *required]
+    for name in fields:
+        columns.extend(BOOK_FIELDS[name][0])
+    query = db.session.query(*dict.fromkeys(columns)).select_from(Book)
+    if 'cover_url' in fields:
+        query = query.outerjoin(Cover, Book.cover_id == Cover.id)
+    return query
+
+
+def serialize_books(rows, fields):
+    genres = {}
+    if 'genres' in fields and rows:
+        genre_rows = db.session.execute(
+            select(book_genres.c.book_id, Genre.name).join(Genre, Genre.id == book_genres.c.genre_id)
+            .where(book_genres.c.book_id.in_([row.id for row in rows])).order_by(Genre.name))
+        for book_id, name in genre_rows:
+            genres.setdefault(book_id, []).append(name)
+    items = []
+    for row in rows:
+        item = {}
+        for name in fields:
+            getter = BOOK_FIELDS[name][1]
+            item[name] = genres.get(row.id, []) if name == 'genres' else getter(row)
+        items.append(item)
+    return items
+
+
+def weak_etag(*parts):
+    return hashlib.md5(json.dumps(parts, default=str).encode()).hexdigest()
+
+
+def conditional_json(payload, etag):
+    response = jsonify(payload)
+    response.set_etag(etag, weak=True)
+    response.headers['Cache-Control'] = 'no-cache'  # Кэшировать можно, но перед использованием перепроверять
+    return response.make_conditional(request)
+
+
+def not_modified(etag):
+    # Ответ 304 без запроса самих данных: клиенту достаточно совпадения версии книги
+    if request.if_none_match.contains_weak(etag):
+        response = app.response_class(status=304)
+        response.set_etag(etag, weak=True)
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+    return None
+
+
+def book_version(book_id):
+    version = db.session.scalar(select(Book.version).where(Book.id == book_id))
+    if version is None:
+        api_error('Книга не найдена.', 404)
+    return version
+
+
+def page_links(endpoint, page, **view_args):
+    args = request.args.to_dict(flat=False)
+    args.pop('after', None)
+    args.pop('before', None)
+    return {
+        'next': url_for(endpoint, **view_args, **args, after=page.next_cursor) if page.has_next else None,
+        'prev': url_for(endpoint, **view_args, **args, before=page.prev_cursor) if page.has_prev else None,
+    }
+
+
+@app.route('/api/books')
+@replica_reads
+def api_books():
+    form = BookSearchForm(request.args)
+    if not form.validate():
+        return jsonify({'errors': form.errors}), 400
+    fields = requested_fields(LIST_FIELDS)
+    # Порядок как в каталоге, но без ранжирования по релевантности: курсору нужен устойчивый ключ
+    query, _rank = search.filter_books(book_query(fields, Book.publication_year, Book.version), form.filter_args())
+    page = keyset_paginate(query, [Book.publication_year, Book.id], page_size(),
+                           after=request.args.get('after'), before=request.args.get('before'))
+    payload = {'items': serialize_books(page.items, fields), **page_links('api_books', page)}
+    # Список меняется, если изменилась любая книга на странице или её состав
+    etag = weak_etag('books', fields, [(row.id, row.version) for row in page.items], payload['next'], payload['prev'])
+    return conditional_json(payload, etag)
+
+
+@app.route('/api/books/<int:book_id>')
+@replica_reads
+def api_book(book_id):
+    fields = requested_fields(DETAIL_FIELDS)
+    etag = weak_etag('book', book_id, book_version(book_id), fields)
+    response = not_modified(etag)
+    if response is not None:
+        return response
+    row = book_query(fields).filter(Book.id == book_id).first()
+    if row is None:
+        api_error('Книга не найдена.', 404)
+    return conditional_json(serialize_books([row], fields)[0], etag)
+
+
+@app.route('/api/books/<int:book_id>/reviews')
+@replica_reads
+def api_book_reviews(book_id):
+    per_page = page_size()
+    after, before = request.args.get('after'), request.args.get('before')
+    # Новая рецензия увеличивает версию книги (Book.register_review), поэтому ETag страницы строится по ней
+    etag = weak_etag('reviews', book_id, book_version(book_id), per_page, after, before)
+    response = not_modified(etag)
+    if response is not None:
+        return response
+    query = db.session.query(Review.id, Review.rating, Review.text, Review.created_at,
+                             User.first_name, User.last_name, User.patronymic) \
+        .join(User, Review.user_id == User.id).filter(Review.book_id == book_id)
+    page = keyset_paginate(query, [Review.created_at, Review.id], per_page, after=after, before=before)
+    items = [{'id': row.id, 'rating': row.rating, 'text': row.text, 'created_at': row.created_at.isoformat(),
+              'author': User.format_full_name(row.first_name, row.last_name, row.patronymic)}
+             for row in page.items]
+    return conditional_json({'items': items, **page_links('api_book_reviews', page, book_id=book_id)}, etag)
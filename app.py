@@ -7,7 +7,7 @@ import os
 # from functools import wraps # Этот импорт не нужен здесь, если roles_required перемещен в routes.py
 
 # Импортируем db и login_manager из нового файла extensions.py
-from extensions import db, login_manager
+from extensions import db, login_manager, engine_options, configure_engine
 
 # Инициализация Flask-приложения
 app = Flask(__name__, template_folder='templates/')
@@ -22,8 +22,12 @@ if not os.path.exists(os.path.join(os.path.abspath(os.path.dirname(__file__)), '
     os.makedirs(os.path.join(os.path.abspath(os.path.dirname(__file__)), 'instance'))
 
 
-# Привязываем SQLAlchemy к приложению
+# Привязываем SQLAlchemy к приложению с параметрами движка из профиля DB_ENGINE_PROFILE
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {**engine_options(app.config), **app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {})}
 db.init_app(app)
+with app.app_context():
+    for engine in db.engines.values(): # Основная БД и реплика (SQLALCHEMY_BINDS)
+        configure_engine(engine, app.config)
 
 # Привязываем Flask-Login к приложению
 login_manager.init_app(app)
@@ -32,14 +36,20 @@ login_manager.login_message = 'Для выполнения данного дей
 login_manager.login_message_category = 'warning'
 
 # Теперь можно импортировать модели. Они будут импортировать 'db' из extensions.py.
-from models import User, Role, Book, Review, PageView, Cover, Genre
+from models import Role, Book, Review, PageView, Cover, Genre
+
+
+import identity # Загрузка пользователя вместе с ролью и кэш воркера (identity.py)
 
 
 @login_manager.user_loader
 def load_user(user_id):
-    return db.session.get(User, int(user_id))
+    return identity.load_user(user_id)
 
 from routes import *
+import api # JSON API: каталог (/api/books) и приём просмотров (POST /api/views)
+import replica # Чтение с реплики для отмеченных маршрутов и привязка к основной БД после изменений
+import commands # CLI-команды обслуживания БД (flask --app app upgrade-db и др.)
 
 # Обработчики ошибок
 @app.errorhandler(404)
@@ -0,0 +1,116 @@
+# electronic_library/bench_concurrency.py
+# Бенчмарк конкурентного чтения и записи для профилей движка DB_ENGINE_PROFILE ('default' и 'production').
+# Запуск: python bench_concurrency.py [--workers 4] [--seconds 10] [--write-ratio 0.3]
+# Каждый воркер — отдельный процесс со своим импортом приложения, как воркер gunicorn без preload.
+# Чтение — страницы каталога, запись — открытие страницы книги (INSERT в page_views и commit).
+# Для каждого профиля печатает пропускную способность, задержки и число ошибок ("database is locked").
+
+import argparse
+import multiprocessing
+import os
+import random
+import shutil
+import tempfile
+import time
+
+PROFILES = ('default', 'production')
+
+
+def configure(db_path, profile):
+    # Настройки читаются из окружения при импорте config.py, поэтому задаются до импорта приложения
+    os.environ['DATABASE_URL'] = 'sqlite:///' + db_path
+    os.environ['DB_ENGINE_PROFILE'] = profile
+    os.environ['PAGE_VIEW_RECORDING'] = 'sync'
+    from app import app
+    app.config['FRAGMENT_CACHE_SECONDS'] = 0  # Чтения должны доходить до БД, а не до кэша страниц
+    return app
+
+
+def seed(db_path, profile, books):
+    app = configure(db_path, profile)
+    from sqlalchemy import insert
+    from extensions import db
+    from models import Book
+    with app.app_context():
+        db.create_all()
+        db.session.execute(insert(Book), [
+            {'title': f'Книга {i}', 'short_description': '<p>-</p>', 'publication_year': 1900 + i % 120,
+             'publisher': 'Издательство', 'author': f'Автор {i % 50}', 'pages': 100 + i}
+            for i in range(books)])
+        db.session.commit()
+
+
+def worker(db_path, profile, books, seconds, write_ratio, start_at, results):
+    app = configure(db_path, profile)
+    client = app.test_client()
+    rnd = random.Random(os.getpid())
+    pages = max(1, books // app.config['PAGINATION_PER_PAGE'])
+    stats = {'read': [], 'write': [], 'errors': 0}
+    time.sleep(max(0.0, start_at - time.time()))  # Все воркеры стартуют одновременно, после импорта
+    deadline = time.time() + seconds
+    while time.time() < deadline:
+        if rnd.random() < write_ratio:
+            kind, url = 'write', f'/book/{rnd.randint(1, books)}'
+        else:
+            kind, url = 'read', f'/?page={rnd.randint(1, pages)}'
+        # Случайный IP, чтобы запись не упиралась в MAX_VIEWS_PER_DAY
+        environ = {'REMOTE_ADDR': f'10.{rnd.randint(0, 255)}.{rnd.randint(0, 255)}.{rnd.randint(1, 254)}'}
+        started = time.perf_counter()
+        try:
+            ok = client.get(url, environ_base=environ).status_code == 200
+        except Exception:
+            ok = False
+        if ok:
+            stats[kind].append(time.perf_counter() - started)
+        else:
+            stats['errors'] += 1
+    results.put(stats)
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))] * 1000
+
+
+def run(profile, args):
+    tmp_dir = tempfile.mkdtemp()
+    db_path = os.path.join(tmp_dir, 'bench.db')
+    try:
+        context = multiprocessing.get_context('spawn')
+        process = context.Process(target=seed, args=(db_path, profile, args.books))
+        process.start()
+        process.join()
+
+        results = context.Queue()
+        start_at = time.time() + 5  # Запас на импорт приложения в каждом процессе
+        processes = [context.Process(target=worker, args=(db_path, profile, args.books, args.seconds,
+                                                          args.write_ratio, start_at, results))
+                     for _ in range(args.workers)]
+        for process in processes:
+            process.start()
+        collected = [results.get() for _ in processes]
+        for process in processes:
+            process.join()
+
+        print(f'\n=== Профиль {profile} ({args.workers} воркеров, {args.seconds} с) ===')
+        for kind, title in (('read', 'чтение'), ('write', 'запись')):
+            latencies = [value for stats in collected for value in stats[kind]]
+            print(f'{title:>8}: {len(latencies) / args.seconds:8.1f} запр/с   '
+                  f'p50 {percentile(latencies, 0.5):6.1f} мс   p99 {percentile(latencies, 0.99):7.1f} мс')
+        print(f'{"ошибки":>8}: {sum(stats["errors"] for stats in collected)}')
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Бенчмарк конкурентного чтения/записи по профилям движка')
+    parser.add_argument('--workers', type=int, default=4, help='количество процессов-воркеров')
+    parser.add_argument('--seconds', type=int, default=10, help='длительность замера для каждого профиля')
+    parser.add_argument('--write-ratio', type=float, default=0.3, help='доля запросов с записью просмотра')
+    parser.add_argument('--books', type=int, default=200)
+    parser.add_argument('--profile', choices=PROFILES, action='append', help='профиль (по умолчанию оба)')
+    args = parser.parse_args()
+    for profile in args.profile or PROFILES:
+        run(profile, args)
@@ -0,0 +1,115 @@
+# electronic_library/bench_page_views.py
+# Бенчмарк индексов page_views на синтетических данных (по умолчанию ~1 млн просмотров).
+# Запуск: python bench_page_views.py [--rows 1000000]
+# Для каждого горячего запроса печатает EXPLAIN QUERY PLAN и время выполнения
+# сначала без индексов (как в старых БД), затем после их создания.
+
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+parser = argparse.ArgumentParser(description='Бенчмарк индексов таблицы page_views')
+parser.add_argument('--rows', type=int, default=1_000_000, help='количество синтетических просмотров')
+parser.add_argument('--books', type=int, default=500)
+parser.add_argument('--users', type=int, default=200)
+args = parser.parse_args()
+
+# База создаётся во временном каталоге, рабочая БД не затрагивается
+tmp_dir = tempfile.mkdtemp()
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tmp_dir, 'bench.db')
+
+from sqlalchemy import insert, select, func, text
+from app import app
+from extensions import db
+from models import Role, User, Book, PageView
+
+BATCH = 50_000
+
+
+def seed():
+    db.create_all()
+    for index in PageView.__table__.indexes:
+        index.drop(db.engine)  # Имитируем БД, созданную до появления индексов
+
+    role = Role(name='user')
+    db.session.add(role)
+    db.session.flush()
+    db.session.execute(insert(User), [
+        {'login': f'user{i}', 'password_hash': '-', 'last_name': 'Тестов', 'first_name': f'Юзер{i}', 'role_id': role.id}
+        for i in range(args.users)])
+    db.session.execute(insert(Book), [
+        {'title': f'Книга {i}', 'short_description': '-', 'publication_year': 1900 + i % 120,
+         'publisher': 'Издательство', 'author': f'Автор {i % 50}', 'pages': 100 + i}
+        for i in range(args.books)])
+    db.session.commit()
+
+    now = datetime.now(timezone.utc)
+    rnd = random.Random(42)
+    started = time.perf_counter()
+    for offset in range(0, args.rows, BATCH):
+        rows = []
+        for _ in range(min(BATCH, args.rows - offset)):
+            authenticated = rnd.random() < 0.6
+            rows.append({
+                'book_id': rnd.randint(1, args.books),
+                'user_id': rnd.randint(1, args.users) if authenticated else None,
+                'view_time': now - timedelta(seconds=rnd.randint(0, 365 * 24 * 3600)),
+                'ip_address': f'10.0.{rnd.randint(0, 255)}.{rnd.randint(0, 255)}',
+            })
+        db.session.execute(insert(PageView), rows)
+        db.session.commit()
+    print(f'Сгенерировано {args.rows} просмотров за {time.perf_counter() - started:.1f} с')
+
+
+def hot_queries():
+    now = datetime.now(timezone.utc)
+    today_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    month_ago = now - timedelta(days=30)
+    return {
+        'view_book: лимит по пользователю': select(func.count(PageView.id)).where(
+            PageView.book_id == 7, PageView.user_id == 3, PageView.view_time.between(today_start, now)),
+        'view_book: лимит по IP гостя': select(func.count(PageView.id)).where(
+            PageView.book_id == 7, PageView.ip_address == '10.0.1.1', PageView.user_id.is_(None),
+            PageView.view_time.between(today_start, now)),
+        'index: недавно просмотренные (пользователь)': select(PageView).where(
+            PageView.user_id == 3).order_by(PageView.view_time.desc()).limit(5),
+        'index: недавно просмотренные (гость)': select(PageView).where(
+            PageView.ip_address == '10.0.1.1', PageView.user_id.is_(None)).order_by(PageView.view_time.desc()).limit(5),
+        'statistics: журнал (первая страница)': select(PageView).order_by(PageView.view_time.desc()).limit(10),
+        'statistics: просмотры по книгам за месяц': select(PageView.book_id, func.count(PageView.id)).where(
+            PageView.user_id.isnot(None), PageView.view_time >= month_ago).group_by(PageView.book_id),
+    }
+
+
+def report(title):
+    print(f'\n=== {title} ===')
+    connection = db.session.connection()
+    for name, query in hot_queries().items():
+        sql = str(query.compile(dialect=db.engine.dialect, compile_kwargs={'literal_binds': True}))
+        plan = connection.execute(text('EXPLAIN QUERY PLAN ' + sql)).fetchall()
+        started = time.perf_counter()
+        for _ in range(3):
+            connection.execute(text(sql)).fetchall()
+        elapsed = (time.perf_counter() - started) / 3 * 1000
+        print(f'\n{name}: {elapsed:.2f} мс')
+        for row in plan:
+            print(f'    {row[-1]}')
+
+
+try:
+    with app.app_context():
+        seed()
+        report('Без индексов')
+        started = time.perf_counter()
+        for index in PageView.__table__.indexes:
+            index.create(db.engine)
+        db.session.execute(text('ANALYZE'))
+        db.session.commit()
+        print(f'\nИндексы созданы за {time.perf_counter() - started:.1f} с')
+        report('С индексами')
+finally:
+    shutil.rmtree(tmp_dir, ignore_errors=True)
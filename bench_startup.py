@@ -0,0 +1,109 @@
+# electronic_library/bench_startup.py
+# Бенчмарк запуска воркера: время импорта приложения и потребление памяти.
+# Запуск: python bench_startup.py [--top 15] [--runs 3]
+# Печатает время `import app` (по python -X importtime), самые дорогие модули и RSS процесса
+# сразу после импорта и после первого использования лениво загружаемых библиотек
+# (рендер Markdown, построение миниатюр).
+
+import argparse
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+parser = argparse.ArgumentParser(description='Бенчмарк времени импорта и памяти воркера')
+parser.add_argument('--top', type=int, default=15, help='сколько самых медленных модулей показать')
+parser.add_argument('--runs', type=int, default=3, help='количество замеров времени импорта')
+args = parser.parse_args()
+
+IMPORTTIME_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)')
+
+# Замер памяти выполняется в отдельном процессе, чтобы импорт в этом скрипте не влиял на результат
+MEMORY_PROBE = '''
+import time
+
+def rss():
+    with open('/proc/self/status') as status:
+        for line in status:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+started = time.perf_counter()
+import app
+print('import', time.perf_counter() - started, rss())
+
+import rendering
+started = time.perf_counter()
+rendering.render('description', '# Заголовок\\n\\n*текст*')
+print('render', time.perf_counter() - started, rss())
+
+import io
+import os
+import tempfile
+import thumbnails
+from PIL import Image
+started = time.perf_counter()
+source = os.path.join(tempfile.mkdtemp(), 'cover.png')
+Image.new('RGB', (600, 900), (120, 40, 40)).save(source)
+app.app.config['THUMBNAIL_FOLDER'] = os.path.dirname(source)
+thumbnails.render_thumbnails(source, 'bench')
+print('thumbnails', time.perf_counter() - started, rss())
+'''
+
+
+def run_python(*python_args):
+    return subprocess.run([sys.executable, *python_args], capture_output=True, text=True,
+                          cwd=os.path.dirname(os.path.abspath(__file__)), env=os.environ)
+
+
+def import_profile():
+    """Суммарное время импорта (мс) и список (собственное, накопленное, модуль) по importtime."""
+    result = run_python('-X', 'importtime', '-c', 'import app')
+    if result.returncode != 0:
+        sys.exit(result.stderr)
+    modules = []
+    total = 0
+    for line in result.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if not match:
+            continue
+        self_us, cumulative_us, indent, name = int(match[1]), int(match[2]), match[3], match[4]
+        modules.append((self_us / 1000, cumulative_us / 1000, name))
+        if len(indent) == 1:  # Модули верхнего уровня: их накопленное время не пересекается
+            total += cumulative_us / 1000
+    return total, modules
+
+
+# База создаётся во временном каталоге, рабочая БД не затрагивается
+tmp_dir = tempfile.mkdtemp()
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tmp_dir, 'bench.db')
+
+try:
+    timings = []
+    for _ in range(args.runs):
+        started = time.perf_counter()
+        total, modules = import_profile()
+        timings.append((total, time.perf_counter() - started))
+    print(f'import app (importtime): {min(t[0] for t in timings):.0f} мс (лучший из {args.runs})')
+    print(f'запуск интерпретатора + import app: {min(t[1] for t in timings) * 1000:.0f} мс')
+
+    print('\nСамые медленные модули (накопленное время, последний замер):')
+    for self_ms, cumulative_ms, name in sorted(modules, key=lambda m: m[1], reverse=True)[:args.top]:
+        print(f'    {cumulative_ms:8.1f} мс  (собственное {self_ms:6.1f})  {name}')
+
+    lazy = [name for name in ('bleach', 'markdown', 'PIL') if any(m[2] == name for m in modules)]
+    print(f'\nТяжёлые библиотеки, импортируемые при запуске: {", ".join(lazy) or "нет"}')
+
+    result = run_python('-c', MEMORY_PROBE)
+    if result.returncode != 0:
+        sys.exit(result.stderr)
+    print('\nПамять процесса (RSS):')
+    for line in result.stdout.splitlines():
+        stage, elapsed, rss = line.split()
+        print(f'    после {stage:<10} {float(rss):7.1f} МиБ  (этап {float(elapsed) * 1000:.0f} мс)')
+finally:
+    shutil.rmtree(tmp_dir, ignore_errors=True)
@@ -0,0 +1,196 @@
+# electronic_library/commands.py
+# CLI-команды обслуживания базы данных: flask --app app <команда>
+
+import click
+import time
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import MetaData, inspect, text
+from sqlalchemy.schema import CreateColumn
+
+from extensions import db
+from app import app
+from models import Book, Cover, Review, BookViewDaily
+import covers
+import thumbnails
+import rendering
+import search
+import tracking
+import stats
+import replica
+
+
+def add_missing_columns():
+    # Добавляет в существующие таблицы колонки, появившиеся в моделях после создания БД
+    inspector = inspect(db.session.connection())
+    existing_tables = set(inspector.get_table_names())
+    added = []
+    for table in db.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        existing_columns = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing_columns:
+                continue
+            column_ddl = CreateColumn(column).compile(dialect=db.engine.dialect)
+            db.session.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column_ddl}'))
+            added.append(f'{table.name}.{column.name}')
+    return added
+
+
+def add_missing_indexes():
+    # Создаёт индексы, объявленные в моделях, но отсутствующие в существующей БД
+    inspector = inspect(db.session.connection())
+    created = []
+    for table in db.metadata.sorted_tables:
+        existing_indexes = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing_indexes:
+                index.create(db.session.connection())
+                created.append(index.name)
+    return created
+
+
+def render_stored_markdown(force=False):
+    # Заполняет HTML и хэши описаний и рецензий; у старых записей исходника нет —
+    # исходником считается сохранённый ранее санитизированный HTML (Markdown пропускает его как есть)
+    updated = 0
+    for model, field, setter in ((Book, 'short_description', rendering.set_book_description),
+                                 (Review, 'text', rendering.set_review_text)):
+        for obj in model.query.order_by(model.id).yield_per(500):
+            source = getattr(obj, f'{field}_source')
+            if source is None:
+                source = getattr(obj, field)
+            if force:
+                setattr(obj, f'{field}_hash', None)
+            if setter(obj, source):
+                updated += 1
+        db.session.commit()
+    return updated
+
+
+def migrate_cover_links():
+    # Раньше обложка принадлежала одной книге (covers.book_id), теперь книга ссылается
+    # на обложку (books.cover_id). Переносим связи и убираем старую колонку.
+    connection = db.session.connection()
+    if 'book_id' not in {column['name'] for column in inspect(connection).get_columns('covers')}:
+        return False
+    db.session.execute(text('UPDATE books SET cover_id = (SELECT covers.id FROM covers WHERE covers.book_id = books.id)'))
+    if db.engine.dialect.name == 'sqlite':
+        # SQLite не удаляет колонку, участвующую во внешнем ключе, поэтому таблица пересоздаётся
+        new_table = Cover.__table__.to_metadata(MetaData(), name='covers_new')
+        new_table.create(connection)
+        columns = ', '.join(column.name for column in Cover.__table__.columns if column.name != 'ref_count')
+        db.session.execute(text(f'INSERT INTO covers_new ({columns}, ref_count) SELECT {columns}, 1 FROM covers'))
+        db.session.execute(text('DROP TABLE covers'))
+        db.session.execute(text('ALTER TABLE covers_new RENAME TO covers'))
+    else:
+        for foreign_key in inspect(connection).get_foreign_keys('covers'):
+            if foreign_key['constrained_columns'] == ['book_id']:
+                db.session.execute(text(f"ALTER TABLE covers DROP FOREIGN KEY {foreign_key['name']}"))
+        db.session.execute(text('ALTER TABLE covers DROP COLUMN book_id'))
+    covers.recount_references()
+    return True
+
+
+@app.cli.command('upgrade-db')
+def upgrade_db():
+    """Приводит схему существующей БД к текущим моделям."""
+    rollups_missing = BookViewDaily.__tablename__ not in inspect(db.engine).get_table_names()
+    db.create_all()  # Создаёт только отсутствующие таблицы
+    added = add_missing_columns()
+    created_indexes = add_missing_indexes()
+    covers_migrated = migrate_cover_links()
+    search.ensure_search_index()
+    if rollups_missing:
+        # Свёртка просмотров появилась после создания БД — заполняем её по истории
+        tracking.rebuild_daily_views()
+    db.session.commit()
+    for name in added:
+        click.echo(f'Добавлена колонка {name}')
+    for name in created_indexes:
+        click.echo(f'Создан индекс {name}')
+    if covers_migrated:
+        click.echo('Обложки переведены на общее хранилище (books.cover_id).')
+    if added:
+        # Новые денормализованные колонки нужно заполнить по фактическим данным
+        Book.recalculate_ratings()
+        db.session.commit()
+        render_stored_markdown()
+    click.echo('Схема базы данных обновлена.')
+
+
+@app.cli.command('recalc-ratings')
+def recalc_ratings():
+    """Пересчитывает review_count и rating_sum у всех книг по таблице reviews."""
+    updated = Book.recalculate_ratings()
+    db.session.commit()
+    click.echo(f'Агрегаты рецензий пересчитаны для {updated} книг.')
+
+
+@app.cli.command('rebuild-search-index')
+def rebuild_search_index():
+    """Создаёт (при необходимости) и заново заполняет полнотекстовый индекс книг."""
+    search.ensure_search_index()
+    db.session.commit()
+    click.echo(f'Поисковый индекс перестроен (режим: {search.get_backend()}).')
+
+
+@app.cli.command('rebuild-view-rollups')
+def rebuild_view_rollups():
+    """Пересчитывает суточную свёртку просмотров book_view_daily по таблице page_views."""
+    rows = tracking.rebuild_daily_views()
+    db.session.commit()
+    stats.invalidate()
+    click.echo(f'Свёртка просмотров пересчитана: {rows} строк.')
+
+
+@app.cli.command('gc-covers')
+def gc_covers():
+    """Пересчитывает ссылки на обложки и удаляет обложки, на которые не ссылается ни одна книга."""
+    covers.recount_references()
+    db.session.commit()
+    removed = covers.collect_garbage()
+    click.echo(f'Удалено неиспользуемых обложек: {removed}.')
+
+
+@app.cli.command('build-thumbnails')
+@click.option('--all', 'rebuild_all', is_flag=True, help='Перестроить копии и для уже обработанных обложек.')
+def build_thumbnails(rebuild_all):
+    """Строит уменьшенные копии обложек (по умолчанию — только для обложек без них)."""
+    query = db.session.query(Cover.id)
+    if not rebuild_all:
+        query = query.filter(Cover.thumbnails_ready.is_(False))
+    cover_ids = [cover_id for cover_id, in query]
+    db.session.commit()
+    with ThreadPoolExecutor(max_workers=app.config['COVER_THUMBNAIL_WORKERS']) as executor:
+        built = sum(executor.map(thumbnails.build_thumbnails, cover_ids))
+    click.echo(f'Миниатюры построены для {built} из {len(cover_ids)} обложек.')
+
+
+@app.cli.command('render-markdown')
+@click.option('--all', 'rebuild_all', is_flag=True, help='Перестроить HTML и для записей с актуальным хэшем.')
+def render_markdown(rebuild_all):
+    """Строит сохранённый HTML описаний и рецензий из исходного Markdown (после смены правил рендера)."""
+    updated = render_stored_markdown(force=rebuild_all)
+    click.echo(f'HTML перестроен для {updated} записей.')
+
+
+@app.cli.command('sync-replica')
+@click.option('--interval', type=float, default=None,
+              help='Повторять копирование каждые N секунд (без значения — один раз; 0 — REPLICA_SYNC_INTERVAL).')
+def sync_replica(interval):
+    """Копирует основную SQLite-БД в файл реплики (REPLICA_DATABASE_URL) для локальной проверки."""
+    if not replica.replica_enabled():
+        raise click.ClickException('Реплика не настроена: задайте REPLICA_DATABASE_URL.')
+    if not (replica.sqlite_path(app.config['SQLALCHEMY_DATABASE_URI'])
+            and replica.sqlite_path(app.config['SQLALCHEMY_BINDS'][replica.REPLICA_BIND])):
+        raise click.ClickException('Копирование поддерживается только для файлов SQLite; '
+                                   'для MySQL используйте штатную репликацию сервера.')
+    if interval == 0:
+        interval = app.config['REPLICA_SYNC_INTERVAL']
+    while True:
+        elapsed = replica.sync_replica()
+        click.echo(f'Реплика обновлена за {elapsed:.2f} с.')
+        if interval is None:
+            break
+        time.sleep(interval)
@@ -15,4 +15,71 @@ class Config:
     ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
     PAGINATION_PER_PAGE = 10
     POPULAR_BOOKS_PERIOD_MONTHS = 3 # Для варианта 4, популярные книги за последние 3 месяца
-    MAX_VIEWS_PER_DAY = 10 # Максимальное количество просмотров для одной книги в день на пользователя/IP
\ No newline at end of file
+    POPULAR_BOOKS_CACHE_SECONDS = 60 # Сколько секунд список популярных книг живёт в кэше процесса
+    MAX_VIEWS_PER_DAY = 10 # Максимальное количество просмотров для одной книги в день на пользователя/IP
+    # Режим записи просмотров: 'sync' — INSERT и commit в каждом запросе,
+    # 'buffered' — накопление в памяти процесса и пакетная запись фоновым потоком
+    PAGE_VIEW_RECORDING = os.environ.get('PAGE_VIEW_RECORDING', 'sync')
+    PAGE_VIEW_FLUSH_SIZE = 200 # Сбрасывать буфер при накоплении стольких просмотров
+    PAGE_VIEW_FLUSH_INTERVAL = 2.0 # ...или не реже чем раз в столько секунд
+    # Хранилище счётчиков MAX_VIEWS_PER_DAY: 'sqlite' — общий файл для всех воркеров gunicorn на одной машине,
+    # 'memory' — в памяти процесса, только для запуска в один воркер (иначе лимит умножается на число воркеров)
+    VIEW_LIMIT_BACKEND = os.environ.get('VIEW_LIMIT_BACKEND', 'sqlite')
+    VIEW_LIMIT_DB = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'instance', 'view_limits.db')
+    VIEW_LIMIT_MAX_KEYS = 100000 # Максимум счётчиков в памяти процесса (вытесняются по LRU)
+    EXPORT_FOLDER = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'instance', 'exports') # Результаты фонового экспорта CSV
+    EXPORT_WORKERS = 2 # Потоков для фоновых заданий экспорта в каждом воркере
+    EXPORT_CACHE_SECONDS = 300 # Готовый файл с теми же фильтрами переиспользуется столько секунд
+    EXPORT_RETENTION_SECONDS = 24 * 3600 # Через сколько удалять старые файлы экспорта
+    JOURNAL_COUNT_CACHE_SECONDS = 60 # Как долго кэшируется общее число записей журнала просмотров
+    STATS_CACHE_SECONDS = 60 # Кэш статистики по диапазонам, включающим текущие сутки
+    STATS_CLOSED_CACHE_SECONDS = 3600 # Кэш статистики по закрытым диапазонам (после stats.invalidate() сбрасывается раньше; с FRAGMENT_CACHE_BACKEND='memory' — не дольше FRAGMENT_CACHE_SECONDS)
+    UPLOAD_CHUNK_SIZE = 64 * 1024 # Размер порции при записи загружаемого файла на диск
+    THUMBNAIL_FOLDER = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'static/covers/thumbs') # Уменьшенные копии обложек
+    COVER_THUMBNAIL_WIDTHS = (120, 240, 480) # Ширины копий в пикселях (карточка каталога — 100px, страница книги — до 480px)
+    COVER_THUMBNAIL_WEBP = True # Дополнительно сохранять копии в WebP (если Pillow собран с его поддержкой)
+    COVER_THUMBNAIL_WORKERS = 2 # Потоков для построения копий после загрузки в каждом воркере
+    COVER_CACHE_MAX_AGE = 365 * 24 * 3600 # Срок кэширования обложек по URL с хэшем содержимого (Cache-Control: immutable)
+    # Кто отдаёт файлы обложек: '' — сам Flask, 'x-sendfile' — Apache/lighttpd (X-Sendfile),
+    # 'x-accel' — nginx (X-Accel-Redirect на внутренний location COVER_ACCEL_PREFIX с alias на UPLOAD_FOLDER)
+    COVER_SENDFILE_MODE = os.environ.get('COVER_SENDFILE_MODE', '')
+    COVER_ACCEL_PREFIX = '/protected-covers/'
+    # Кэш фрагментов каталога и страниц книг и поколения для справочника и статистики: 'sqlite' — общий файл
+    # для всех воркеров gunicorn, 'memory' — в памяти процесса, только для запуска в один воркер
+    # (инвалидация видна лишь воркеру, обработавшему изменение)
+    FRAGMENT_CACHE_BACKEND = os.environ.get('FRAGMENT_CACHE_BACKEND', 'sqlite')
+    FRAGMENT_CACHE_DB = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'instance', 'fragments.db')
+    FRAGMENT_CACHE_SECONDS = 60 # Время жизни фрагмента; 0 — кэш выключен
+    FRAGMENT_CACHE_MAX_ITEMS = 2000 # Максимум фрагментов в памяти воркера
+    REFERENCE_DATA_SECONDS = 300 # Не дольше скольких секунд воркер держит справочник жанров и годов без перечитывания (с FRAGMENT_CACHE_BACKEND='memory' — не дольше FRAGMENT_CACHE_SECONDS)
+    USER_CACHE_SECONDS = 60 # Сколько воркер держит пользователя с ролью для Flask-Login без запроса к БД
+    USER_CACHE_MAX_ITEMS = 10000 # Максимум пользователей в кэше воркера (LRU)
+    # Профиль движка SQLAlchemy: 'production' — WAL и прагмы для SQLite, настроенный пул для MySQL;
+    # 'default' — параметры драйвера по умолчанию (журнал отката, пул SQLAlchemy без изменений)
+    DB_ENGINE_PROFILE = os.environ.get('DB_ENGINE_PROFILE', 'production')
+    # Выполняются на каждом новом соединении SQLite. WAL позволяет читать во время записи просмотров,
+    # synchronous=NORMAL в режиме WAL не теряет целостность и не делает fsync на каждый commit
+    SQLITE_PRAGMAS = {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': 5000, # Сколько миллисекунд ждать снятия блокировки записи вместо ошибки "database is locked"
+        'mmap_size': 256 * 1024 * 1024, # Чтение файла БД через отображение в память
+    }
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 10)) # Постоянных соединений MySQL в каждом воркере
+    DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 10)) # Дополнительных соединений при пиковой нагрузке
+    DB_POOL_TIMEOUT = 10 # Сколько секунд ждать свободного соединения из пула
+    DB_POOL_RECYCLE = 1800 # Пересоздавать соединения старше стольких секунд (меньше wait_timeout MySQL)
+    DB_POOL_PRE_PING = True # Проверять соединение перед выдачей из пула (после перезапуска MySQL)
+    # Реплика только для чтения: каталог, статистика и экспорт читают с неё (см. replica.py).
+    # Без REPLICA_DATABASE_URL все запросы идут в основную БД. Для локальной проверки подойдёт второй
+    # файл SQLite, который обновляет `flask --app app sync-replica --interval 5`
+    REPLICA_DATABASE_URL = os.environ.get('REPLICA_DATABASE_URL')
+    SQLALCHEMY_BINDS = {'replica': REPLICA_DATABASE_URL} if REPLICA_DATABASE_URL else {}
+    REPLICA_STICKY_SECONDS = 30 # Сколько секунд после своих изменений пользователь (и после invalidate() — промахи кэшей) читает с основной БД; больше отставания реплики
+    REPLICA_SYNC_INTERVAL = 5 # Период копирования по умолчанию для sync-replica --interval
+    # Учёт просмотров отдельным запросом POST /api/views со страницы книги (navigator.sendBeacon) вместо
+    # записи при рендере view_book: страница не пишет в БД, просмотры сохраняются пачками в фоне
+    PAGE_VIEW_BEACON = os.environ.get('PAGE_VIEW_BEACON', '0') == '1'
+    API_VIEWS_MAX_BATCH = 50 # Максимум событий просмотра в одном запросе к /api/views
+    API_MAX_PER_PAGE = 100 # Наибольшее значение per_page в JSON API каталога
+    REVIEWS_PER_PAGE = 10 # Рецензий на странице книги; следующие подгружаются по кнопке «Показать ещё»
\ No newline at end of file
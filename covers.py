@@ -0,0 +1,132 @@
+# electronic_library/covers.py
+# Хранилище обложек, адресуемое по содержимому: файл называется по MD5 и хранится один раз,
+# книги ссылаются на него через books.cover_id, а covers.ref_count считает эти ссылки.
+# Повторная загрузка того же изображения не пишет на диск ничего, кроме временного файла,
+# который сразу удаляется. Файл удаляется, когда на обложку не остаётся ни одной ссылки.
+
+import os
+import re
+from urllib.parse import quote
+from flask import request, url_for
+from sqlalchemy import func, select
+from werkzeug.utils import send_from_directory
+
+from extensions import db
+from app import app
+from models import Book, Cover
+from cache import TTLCache
+import thumbnails
+
+# Имена, содержащие MD5 содержимого: новые обложки (<md5>.png) и миниатюры (<md5>_<ширина>.webp)
+HASHED_NAME = re.compile(r'^([0-9a-f]{32})(?:_\d+)?\.\w+$')
+
+# MD5 обложек со старыми именами файлов (для ETag), чтобы не ходить в БД за каждой картинкой
+_legacy_hashes = TTLCache(maxsize=1024, ttl=300)
+
+
+def cover_path(filename):
+    return os.path.join(app.config['UPLOAD_FOLDER'], filename)
+
+
+@app.template_global()
+def cover_url(cover):
+    """URL оригинала обложки, меняющийся вместе с содержимым (такой ответ можно кэшировать навсегда)."""
+    if HASHED_NAME.match(cover.filename):
+        return url_for('uploaded_file', filename=cover.filename)
+    return url_for('uploaded_file', filename=cover.filename, v=cover.md5_hash[:12])
+
+
+def _content_hash(filename):
+    match = HASHED_NAME.match(filename)
+    if match:
+        return match.group(1)
+    return _legacy_hashes.get_or_set(
+        filename, lambda: db.session.query(Cover.md5_hash).filter_by(filename=filename).scalar())
+
+
+def send_cover_file(folder, filename):
+    """Отдаёт файл обложки или миниатюры с кэширующими заголовками.
+
+    ETag строится из MD5 содержимого. Если URL версионирован хэшем (имя файла или ?v=),
+    ответ помечается immutable на COVER_CACHE_MAX_AGE, иначе браузер перепроверяет его по ETag.
+    Условные запросы (If-None-Match/If-Modified-Since) и Range обрабатывает Werkzeug.
+    В режимах x-sendfile/x-accel сам файл отдаёт фронтовой прокси, а не воркер gunicorn.
+    """
+    content_hash = _content_hash(filename)
+    versioned = bool(content_hash) and (HASHED_NAME.match(filename) is not None
+                                        or request.args.get('v') == content_hash[:12])
+    mode = app.config['COVER_SENDFILE_MODE']
+    stem = os.path.splitext(filename)[0]
+    response = send_from_directory(
+        folder, filename, request.environ,
+        etag=stem if HASHED_NAME.match(filename) else (content_hash or True),
+        max_age=app.config['COVER_CACHE_MAX_AGE'] if versioned else None,
+        conditional=True,
+        use_x_sendfile=mode in ('x-sendfile', 'x-accel'),
+        response_class=app.response_class,
+    )
+    if versioned:
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.public = True
+        response.cache_control.no_cache = True
+    if mode == 'x-accel' and 'X-Sendfile' in response.headers:
+        # nginx: внутренний location с alias на UPLOAD_FOLDER (см. COVER_ACCEL_PREFIX)
+        relative = os.path.relpath(response.headers.pop('X-Sendfile'), app.config['UPLOAD_FOLDER'])
+        response.headers['X-Accel-Redirect'] = app.config['COVER_ACCEL_PREFIX'] + quote(relative.replace(os.sep, '/'))
+    return response
+
+
+def store_cover(upload, mime_type, extension):
+    """Возвращает (Cover, путь нового файла или None) для загрузки из uploads.stage_upload.
+
+    Если такое содержимое уже есть, временный файл удаляется, а счётчик ссылок увеличивается.
+    """
+    cover = Cover.query.filter_by(md5_hash=upload.md5_hash).first()
+    if cover:
+        upload.discard()
+        cover.ref_count = Cover.ref_count + 1  # Инкремент в SQL, как и у агрегатов рецензий
+        return cover, None
+    filename = f"{upload.md5_hash}{extension.lower()}"
+    path = upload.commit(filename)
+    cover = Cover(filename=filename, mime_type=mime_type, md5_hash=upload.md5_hash, ref_count=1)
+    db.session.add(cover)
+    return cover, path
+
+
+def discard_file(path):
+    """Удаляет файл после отката транзакции, если на него не ссылается уже сохранённая обложка
+    (та же картинка могла быть параллельно загружена и закоммичена другим запросом)."""
+    if path and os.path.exists(path):
+        if not db.session.query(Cover.id).filter_by(filename=os.path.basename(path)).first():
+            os.remove(path)
+
+
+def release_cover(cover):
+    """Уменьшает счётчик ссылок; сама обложка удаляется в collect_garbage после коммита."""
+    if cover is not None:
+        cover.ref_count = Cover.ref_count - 1
+
+
+def collect_garbage():
+    """Удаляет обложки без ссылок и их файлы. Возвращает число удалённых обложек."""
+    referenced = select(Book.id).where(Book.cover_id == Cover.id).exists()
+    candidates = db.session.query(Cover.id, Cover.filename, Cover.md5_hash).filter(Cover.ref_count <= 0, ~referenced).all()
+    removed = []
+    for cover_id, filename, md5_hash in candidates:
+        # Повторная проверка в самом DELETE: за это время на обложку могла появиться новая ссылка
+        result = db.session.execute(db.delete(Cover).where(Cover.id == cover_id, Cover.ref_count <= 0, ~referenced))
+        if result.rowcount:
+            removed.append((filename, md5_hash))
+    db.session.commit()
+    for filename, md5_hash in removed:
+        if os.path.exists(cover_path(filename)):
+            os.remove(cover_path(filename))
+        thumbnails.remove_thumbnails(md5_hash)
+    return len(removed)
+
+
+def recount_references():
+    """Пересчитывает ref_count по таблице books (восстановление после рассинхронизации)."""
+    count_subquery = select(func.count(Book.id)).where(Book.cover_id == Cover.id).scalar_subquery()
+    return db.session.execute(db.update(Cover).values(ref_count=count_subquery)).rowcount
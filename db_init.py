@@ -2,6 +2,9 @@ import hashlib
 from app import app
 from extensions import db
 from models import Role, User, Genre, Book, Cover
+import search
+import rendering
+import thumbnails
 from werkzeug.security import generate_password_hash
 from datetime import datetime
 import os
@@ -145,13 +148,13 @@ with app.app_context():
                 )
                 book = Book(
                     title=data['title'],
-                    short_description=data['description'],
                     publication_year=data['year'],
                     publisher=data['publisher'],
                     author=data['author'],
                     pages=data['pages'],
                     cover=cover
                 )
+                rendering.set_book_description(book, data['description'])
                 for genre in data['genres']:
                     book.genres.append(genre)
                 db.session.add(book)
@@ -159,6 +162,12 @@ with app.app_context():
             try:
                 db.session.commit()
                 print("Добавлены 5 тестовых книг.")
+                search.ensure_search_index()
+                db.session.commit()
+                print("Поисковый индекс построен.")
+                for cover_id, in db.session.query(Cover.id).all():
+                    thumbnails.build_thumbnails(cover_id)
+                print("Миниатюры обложек построены.")
             except Exception as e:
                 db.session.rollback()
                 print(f"Ошибка при добавлении книг: {e}")
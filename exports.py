@@ -0,0 +1,205 @@
+# electronic_library/exports.py
+# Экспорт журнала и статистики просмотров в CSV: общие генераторы строк
+# для потоковой выдачи и фоновые задания с кэшированием готовых файлов.
+
+import csv
+import gzip
+import hashlib
+import json
+import os
+import time
+import uuid
+from datetime import datetime
+from io import StringIO
+from sqlalchemy import func
+
+from extensions import db
+from app import app
+from models import User, Book, PageView
+from cache import TTLCache
+from workers import ForkSafeExecutor
+import stats
+from replica import use_replica
+
+JOURNAL_HEADER = ['№', 'ФИО пользователя', 'Название книги', 'Дата и время просмотра']
+STATS_HEADER = ['№', 'Название книги', 'Количество просмотров']
+
+
+def parse_date_range(date_from, date_to):
+    """Строки ГГГГ-ММ-ДД из StatisticsFilterForm -> границы по view_time (дата "до" включительно)."""
+    from_day, to_day = stats.parse_day(date_from), stats.parse_day(date_to)
+    from_dt = datetime.combine(from_day, datetime.min.time()) if from_day else None
+    to_dt = datetime.combine(to_day, datetime.max.time()) if to_day else None
+    return from_dt, to_dt
+
+
+def _filter_by_time(query, date_from, date_to):
+    from_dt, to_dt = parse_date_range(date_from, date_to)
+    if from_dt:
+        query = query.filter(PageView.view_time >= from_dt)
+    if to_dt:
+        query = query.filter(PageView.view_time <= to_dt)
+    return query
+
+
+def journal_query(date_from=None, date_to=None):
+    query = db.session.query(
+        PageView.view_time, User.first_name, User.last_name, User.patronymic, Book.title
+    ).outerjoin(User, PageView.user_id == User.id) \
+     .outerjoin(Book, PageView.book_id == Book.id)
+    return _filter_by_time(query, date_from, date_to).order_by(PageView.view_time.desc())
+
+
+def journal_rows(date_from=None, date_to=None):
+    yield JOURNAL_HEADER
+    # Строки читаются с сервера порциями, память не зависит от размера журнала
+    rows = journal_query(date_from, date_to).execution_options(stream_results=True, yield_per=1000)
+    for i, (view_time, first_name, last_name, patronymic, title) in enumerate(rows, start=1):
+        user_info = User.format_full_name(first_name, last_name, patronymic) if first_name else "Неаутентифицированный пользователь"
+        yield [i, user_info, title or "Книга удалена", view_time.strftime('%Y-%m-%d %H:%M:%S')]
+
+
+def stats_rows(date_from=None, date_to=None):
+    yield STATS_HEADER
+    for i, (title, count) in enumerate(stats.stats_query(date_from, date_to), start=1):
+        yield [i, title, count]
+
+
+def journal_total(date_from=None, date_to=None):
+    return _filter_by_time(db.session.query(func.count(PageView.id)), date_from, date_to).scalar()
+
+
+_journal_count_cache = TTLCache(maxsize=1, ttl=app.config['JOURNAL_COUNT_CACHE_SECONDS'])
+
+
+def approximate_journal_total():
+    """Размер журнала для подписи на странице статистики: COUNT(*) выполняется не чаще раза в JOURNAL_COUNT_CACHE_SECONDS."""
+    return _journal_count_cache.get_or_set('total', journal_total)
+
+
+def csv_chunks(rows, chunk_rows=1000):
+    """Превращает строки в CSV-текст порциями по chunk_rows строк (для потоковых ответов)."""
+    sio = StringIO()
+    writer = csv.writer(sio, lineterminator='\n')
+    for i, row in enumerate(rows, start=1):
+        writer.writerow(row)
+        if i % chunk_rows == 0:
+            yield sio.getvalue()
+            sio.seek(0)
+            sio.truncate(0)
+    yield sio.getvalue()
+
+
+EXPORT_KINDS = {
+    'journal': {'rows': journal_rows, 'total': journal_total, 'filename': 'journal_actions'},
+    'stats': {'rows': stats_rows, 'total': stats.stats_total, 'filename': 'book_views_stats'},
+}
+
+
+class ExportJobs:
+    """Фоновые задания экспорта.
+
+    Состояние задания хранится в JSON-файле рядом с результатом, поэтому статус
+    и скачивание доступны из любого воркера gunicorn. Готовый файл переиспользуется
+    для тех же фильтров в течение EXPORT_CACHE_SECONDS.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._pool = ForkSafeExecutor(app, 'EXPORT_WORKERS', 'export')
+
+    @property
+    def folder(self):
+        folder = self.app.config['EXPORT_FOLDER']
+        os.makedirs(folder, exist_ok=True)
+        return folder
+
+    def artifact_path(self, kind, date_from, date_to, compress):
+        key = hashlib.sha1(f'{kind}|{date_from or ""}|{date_to or ""}'.encode()).hexdigest()[:16]
+        return os.path.join(self.folder, f'{kind}_{key}.csv' + ('.gz' if compress else ''))
+
+    def _status_path(self, job_id):
+        return os.path.join(self.folder, f'job_{job_id}.json')
+
+    def _save(self, job):
+        tmp_path = self._status_path(job['id']) + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(job, f, ensure_ascii=False)
+        os.replace(tmp_path, self._status_path(job['id']))
+
+    def get(self, job_id):
+        if not job_id.isalnum():
+            return None
+        try:
+            with open(self._status_path(job_id), encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _purge_expired(self):
+        # Удаляем старые результаты и статусы, чтобы каталог экспорта не рос бесконечно
+        deadline = time.time() - self.app.config['EXPORT_RETENTION_SECONDS']
+        for name in os.listdir(self.folder):
+            path = os.path.join(self.folder, name)
+            try:
+                if os.path.getmtime(path) < deadline:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    def start(self, kind, date_from=None, date_to=None, compress=False):
+        self._purge_expired()
+        path = self.artifact_path(kind, date_from, date_to, compress)
+        job = {
+            'id': uuid.uuid4().hex, 'kind': kind, 'date_from': date_from, 'date_to': date_to,
+            'compress': compress, 'path': path, 'status': 'queued', 'progress': 0, 'total': None,
+            'cached': False, 'error': None, 'created_at': datetime.utcnow().isoformat(),
+        }
+        if os.path.exists(path) and time.time() - os.path.getmtime(path) < self.app.config['EXPORT_CACHE_SECONDS']:
+            # Те же фильтры недавно уже выгружались — отдаём готовый файл без повторного сканирования page_views
+            job.update(status='done', cached=True)
+            self._save(job)
+            return job
+        self._save(job)
+        self._pool.submit(self._run, job)
+        return job
+
+    def _run(self, job):
+        spec = EXPORT_KINDS[job['kind']]
+        tmp_path = f"{job['path']}.{job['id']}.tmp"
+        with self.app.app_context(), use_replica():
+            try:
+                job.update(status='running', total=spec['total'](job['date_from'], job['date_to']))
+                self._save(job)
+                if job['compress']:
+                    f = gzip.open(tmp_path, 'wt', encoding='utf-8', newline='')
+                else:
+                    f = open(tmp_path, 'w', encoding='utf-8', newline='')
+                with f:
+                    writer = csv.writer(f, lineterminator='\n')
+                    rows = spec['rows'](job['date_from'], job['date_to'])
+                    writer.writerow(next(rows))
+                    written = 0
+                    for written, row in enumerate(rows, start=1):
+                        writer.writerow(row)
+                        if written % 5000 == 0:
+                            job['progress'] = written
+                            self._save(job)
+                    job['progress'] = job['total'] = written
+                os.replace(tmp_path, job['path'])  # Файл появляется атомарно, целиком
+                job['status'] = 'done'
+            except Exception as e:
+                job.update(status='failed', error=str(e))
+                self.app.logger.error(f"Ошибка экспорта {job['kind']}: {e}")
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+            finally:
+                self._save(job)
+                db.session.remove()
+
+    def download_name(self, job):
+        name = f"{EXPORT_KINDS[job['kind']]['filename']}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
+        return name + ('.gz' if job['compress'] else '')
+
+
+export_jobs = ExportJobs(app)
@@ -1,5 +1,56 @@
+from flask import g, has_app_context
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session
 from flask_login import LoginManager
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
 
-db = SQLAlchemy()
-login_manager = LoginManager()
\ No newline at end of file
+REPLICA_BIND = 'replica' # Ключ SQLALCHEMY_BINDS для реплики только для чтения
+
+
+class RoutingSession(Session):
+    """Сессия, которая отправляет чтения на реплику, если контекст это разрешил (см. replica.py).
+
+    Запись (flush и INSERT/UPDATE/DELETE) всегда идёт на основную БД; после первой записи
+    в контексте на основную БД идут и чтения, чтобы запрос видел собственные изменения.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (bind is None and not self._flushing and not getattr(clause, 'is_dml', False)
+                and has_app_context() and g.get('db_replica_reads') and not g.get('db_wrote')
+                and REPLICA_BIND in self._db.engines):
+            return self._db.engines[REPLICA_BIND]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+login_manager = LoginManager()
+
+
+def engine_options(config):
+    """Параметры create_engine для профиля DB_ENGINE_PROFILE ('production' или 'default' — как у драйвера)."""
+    if config['DB_ENGINE_PROFILE'] != 'production':
+        return {}
+    if make_url(config['SQLALCHEMY_DATABASE_URI']).get_backend_name() == 'sqlite':
+        return {}  # Для SQLite пул выбирает Flask-SQLAlchemy, а прагмы задаются в configure_engine
+    return {
+        'pool_size': config['DB_POOL_SIZE'],
+        'max_overflow': config['DB_MAX_OVERFLOW'],
+        'pool_timeout': config['DB_POOL_TIMEOUT'],
+        'pool_recycle': config['DB_POOL_RECYCLE'],
+        'pool_pre_ping': config['DB_POOL_PRE_PING'],
+    }
+
+
+def configure_engine(engine, config):
+    """Выполняет SQLITE_PRAGMAS на каждом новом соединении SQLite (профиль 'production')."""
+    if config['DB_ENGINE_PROFILE'] != 'production' or engine.dialect.name != 'sqlite':
+        return
+    pragmas = dict(config['SQLITE_PRAGMAS'])
+
+    @event.listens_for(engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name}={value}')
+        cursor.close()
@@ -4,9 +4,9 @@ from flask_wtf import FlaskForm
 from flask_wtf.file import FileField, FileAllowed, FileRequired
 from wtforms import StringField, TextAreaField, IntegerField, SelectMultipleField, SelectField, PasswordField, BooleanField, SubmitField
 from wtforms.validators import DataRequired, Length, NumberRange, ValidationError, Optional
-from models import Genre, Book # Импортируем Genre и Book для динамических выборок
 import datetime
-from extensions import db
+from refdata import reference_data
+from stats import parse_day
 
 class LoginForm(FlaskForm):
     login = StringField('Логин', validators=[DataRequired()])
@@ -30,8 +30,8 @@ class BookForm(FlaskForm):
 
     def __init__(self, *args, **kwargs):
         super(BookForm, self).__init__(*args, **kwargs)
-        # Динамически загружаем жанры из базы данных
-        self.genres.choices = [(g.id, g.name) for g in Genre.query.order_by(Genre.name).all()]
+        # Жанры берутся из справочника воркера (refdata.py), а не запросом при каждом создании формы
+        self.genres.choices = reference_data.genre_choices()
 
 class ReviewForm(FlaskForm):
     rating = SelectField('Оценка', coerce=int, validators=[DataRequired()],
@@ -41,6 +41,9 @@ class ReviewForm(FlaskForm):
     submit = SubmitField('Сохранить рецензию')
 
 class BookSearchForm(FlaskForm):
+    class Meta:
+        csrf = False # Форма фильтров отправляется GET-запросом, CSRF-токена в ней нет
+
     title = StringField('Название')
     genres = SelectMultipleField('Жанр', coerce=int)
     publication_year = SelectMultipleField('Год', coerce=int)
@@ -51,37 +54,59 @@ class BookSearchForm(FlaskForm):
 
     def __init__(self, *args, **kwargs):
         super(BookSearchForm, self).__init__(*args, **kwargs)
-        self.genres.choices = [(g.id, g.name) for g in Genre.query.order_by(Genre.name).all()]
-        # Получаем уникальные года из базы данных
-        years = db.session.query(Book.publication_year).distinct().order_by(Book.publication_year.desc()).all()
-        self.publication_year.choices = [(y[0], str(y[0])) for y in years]
+        self.genres.choices = reference_data.genre_choices()
+        self.publication_year.choices = reference_data.year_choices()
+
+    def filter_args(self):
+        # Фильтры, которые реально применяются, в нормализованном виде (пустые отброшены, списки
+        # отсортированы): по ним строятся ключ кэша каталога, ссылки пагинации и запрос API.
+        # Вызывать после validate()
+        filter_args = {}
+        for name in ('title', 'author'):
+            value = (self[name].data or '').strip()
+            if value:
+                filter_args[name] = value
+        for name in ('genres', 'publication_year'):
+            if self[name].data:
+                filter_args[name] = sorted(set(self[name].data))
+        for name in ('pages_from', 'pages_to'):
+            if self[name].data is not None:
+                filter_args[name] = self[name].data
+        return filter_args
 
-class StatisticsFilterForm(FlaskForm):
+class DateRangeForm(FlaskForm):
+    # Общие поля и проверки диапазона дат для фильтра статистики и фонового экспорта
     date_from = StringField('Дата от', validators=[Optional()])
     date_to = StringField('Дата до', validators=[Optional()])
-    submit = SubmitField('Применить')
 
-    def validate_date_from(self, field):
-        if field.data:
-            try:
-                datetime.strptime(field.data, '%Y-%m-%d')
-            except ValueError:
-                raise ValidationError('Неверный формат даты. Используйте ГГГГ-ММ-ДД.')
+    def _check_day(self, field):
+        try:
+            parse_day(field.data)
+        except ValueError:
+            raise ValidationError('Неверный формат даты. Используйте ГГГГ-ММ-ДД.')
 
-    def validate_date_to(self, field):
-        if field.data:
-            try:
-                datetime.strptime(field.data, '%Y-%m-%d')
-            except ValueError:
-                raise ValidationError('Неверный формат даты. Используйте ГГГГ-ММ-ДД.')
+    validate_date_from = validate_date_to = _check_day
 
     def validate(self, extra_validators=None):
         if not super().validate(extra_validators):
             return False
         if self.date_from.data and self.date_to.data:
-            from_date = datetime.strptime(self.date_from.data, '%Y-%m-%d')
-            to_date = datetime.strptime(self.date_to.data, '%Y-%m-%d')
-            if from_date > to_date:
+            if parse_day(self.date_from.data) > parse_day(self.date_to.data):
                 self.date_from.errors.append('Дата "от" не может быть позже даты "до".')
                 return False
-        return True
\ No newline at end of file
+        return True
+
+    def date_range(self):
+        # Проверенный диапазон (date_from, date_to): строки ГГГГ-ММ-ДД, пустая граница — None.
+        # Вызывать после validate()
+        return self.date_from.data or None, self.date_to.data or None
+
+class StatisticsFilterForm(DateRangeForm):
+    class Meta:
+        csrf = False # Фильтр передаётся в строке запроса GET
+
+    submit = SubmitField('Применить')
+
+class ExportForm(DateRangeForm):
+    # Запуск фонового экспорта — POST-запрос, поэтому CSRF-защита остаётся включённой
+    compress = BooleanField('Сжать (gzip)')
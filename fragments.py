@@ -0,0 +1,172 @@
+# electronic_library/fragments.py
+# Кэш отрендеренных фрагментов страниц (каталог, карточка книги, список рецензий).
+# Персональные части страницы (недавно просмотренные, flash-сообщения, своя рецензия, форма
+# рецензии) в кэшируемые фрагменты не входят и рендерятся в каждом запросе.
+# Инвалидация — через счётчики поколений пространств имён ('catalog', 'book:<id>', 'covers'):
+# поколение входит в ключ, поэтому после invalidate() старые записи просто перестают находиться.
+
+import hashlib
+import json
+import threading
+import time
+from contextlib import nullcontext
+
+from app import app
+from cache import TTLCache
+from localdb import LocalSQLite
+from replica import use_primary
+
+
+class MemoryFragmentBackend:
+    """Фрагменты в памяти процесса (LRU + TTL). Только для одного воркера: инвалидация видна лишь ему."""
+
+    def __init__(self, maxsize, ttl):
+        self._items = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._generations = {}
+        self._bumped_at = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        return self._items.get(key)
+
+    def set(self, key, value):
+        self._items.set(key, value)
+
+    def generations(self, namespaces):
+        with self._lock:
+            return [self._generations.get(namespace, 0) for namespace in namespaces]
+
+    def last_bump(self, namespaces):
+        with self._lock:
+            return max((self._bumped_at.get(namespace, 0) for namespace in namespaces), default=0)
+
+    def bump(self, namespaces):
+        now = time.time()
+        with self._lock:
+            for namespace in namespaces:
+                self._generations[namespace] = self._generations.get(namespace, 0) + 1
+                self._bumped_at[namespace] = now
+
+
+class SQLiteFragmentBackend:
+    """Фрагменты и поколения в отдельном файле SQLite, общем для всех воркеров на одной машине."""
+
+    PURGE_EVERY = 500  # Просроченные записи удаляются раз в столько вставок
+
+    SCHEMA = (
+        'CREATE TABLE IF NOT EXISTS fragments (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)',
+        'CREATE TABLE IF NOT EXISTS fragment_generations '
+        '(namespace TEXT PRIMARY KEY, generation INTEGER NOT NULL, bumped_at REAL NOT NULL)',
+    )
+
+    def __init__(self, path, ttl):
+        self.ttl = ttl
+        self._db = LocalSQLite(path, self.SCHEMA)
+        self._writes = 0
+
+    def get(self, key):
+        row = self._db.connection().execute(
+            'SELECT value FROM fragments WHERE key = ? AND expires_at > ?', (key, time.time())).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, key, value):
+        conn = self._db.connection()
+        conn.execute('INSERT OR REPLACE INTO fragments (key, value, expires_at) VALUES (?, ?, ?)',
+                     (key, json.dumps(value, ensure_ascii=False), time.time() + self.ttl))
+        self._writes += 1
+        if self._writes % self.PURGE_EVERY == 0:
+            conn.execute('DELETE FROM fragments WHERE expires_at <= ?', (time.time(),))
+
+    def generations(self, namespaces):
+        placeholders = ', '.join('?' * len(namespaces))
+        rows = dict(self._db.connection().execute(
+            f'SELECT namespace, generation FROM fragment_generations WHERE namespace IN ({placeholders})',
+            list(namespaces)).fetchall())
+        return [rows.get(namespace, 0) for namespace in namespaces]
+
+    def last_bump(self, namespaces):
+        placeholders = ', '.join('?' * len(namespaces))
+        row = self._db.connection().execute(
+            f'SELECT MAX(bumped_at) FROM fragment_generations WHERE namespace IN ({placeholders})',
+            list(namespaces)).fetchone()
+        return row[0] or 0
+
+    def bump(self, namespaces):
+        now = time.time()
+        self._db.connection().executemany(
+            'INSERT INTO fragment_generations (namespace, generation, bumped_at) VALUES (?, 1, ?) '
+            'ON CONFLICT (namespace) DO UPDATE SET generation = generation + 1, bumped_at = excluded.bumped_at',
+            [(namespace, now) for namespace in namespaces])
+
+
+class FragmentCache:
+    def __init__(self, app):
+        self.app = app
+        self._backend = None
+        self._lock = threading.Lock()
+
+    @property
+    def backend(self):
+        if self._backend is None:
+            with self._lock:
+                if self._backend is None:
+                    ttl = self.app.config['FRAGMENT_CACHE_SECONDS']
+                    if self.app.config['FRAGMENT_CACHE_BACKEND'] == 'sqlite':
+                        self._backend = SQLiteFragmentBackend(self.app.config['FRAGMENT_CACHE_DB'], ttl)
+                    else:
+                        self._backend = MemoryFragmentBackend(self.app.config['FRAGMENT_CACHE_MAX_ITEMS'], ttl)
+        return self._backend
+
+    def get_or_render(self, namespaces, key_parts, render):
+        """Значение фрагмента из кэша или результат render() (строка или список — для SQLite нужен JSON)."""
+        if not self.app.config['FRAGMENT_CACHE_SECONDS']:
+            return render()
+        generations = self.backend.generations(namespaces)
+        raw_key = json.dumps([list(namespaces), generations, key_parts], ensure_ascii=False, default=str)
+        key = hashlib.sha1(raw_key.encode()).hexdigest()
+        value = self.backend.get(key)
+        if value is None:
+            with self.fresh_reads(namespaces):
+                value = render()
+            self.backend.set(key, value)
+        return value
+
+    def fresh_reads(self, namespaces):
+        """Контекст чтения для данных, которые лягут в кэш под текущими поколениями namespaces.
+
+        Первые REPLICA_STICKY_SECONDS после invalidate() реплика может ещё не видеть изменение —
+        такие промахи читают основную БД. В остальное время промах обслуживает реплика, если маршрут
+        отмечен @replica_reads.
+        """
+        if time.time() - self.backend.last_bump(namespaces) < self.app.config['REPLICA_STICKY_SECONDS']:
+            return use_primary()
+        return nullcontext()
+
+    def local_ttl(self, seconds):
+        """Срок жизни для кэша в памяти процесса, ключ которого содержит поколение из этого кэша.
+
+        С бэкендом 'memory' другие воркеры не видят invalidate(), поэтому такие записи живут
+        не дольше фрагментов — FRAGMENT_CACHE_SECONDS.
+        """
+        if self.app.config['FRAGMENT_CACHE_BACKEND'] == 'sqlite':
+            return seconds
+        limit = self.app.config['FRAGMENT_CACHE_SECONDS'] or 1  # У TTLCache ttl=0 — «без истечения»
+        return min(seconds, limit) if seconds else limit
+
+    def generation(self, namespace):
+        """Текущее поколение пространства имён (общее для воркеров при бэкенде sqlite)."""
+        return self.backend.generations([namespace])[0]
+
+    def invalidate(self, *namespaces):
+        self.backend.bump(namespaces)
+
+    def reset(self):
+        with self._lock:
+            self._backend = None
+
+
+fragment_cache = FragmentCache(app)
+
+
+def book_namespace(book_id):
+    return f'book:{book_id}'
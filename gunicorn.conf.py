@@ -0,0 +1,39 @@
+# electronic_library/gunicorn.conf.py
+# Настройки gunicorn (подхватываются автоматически при запуске `gunicorn app:app` из корня проекта)
+
+import gc
+import os
+
+# Приложение импортируется один раз в мастере, воркеры получают его через fork (copy-on-write).
+# GUNICORN_PRELOAD=0 возвращает прежний режим (нужен, например, для перезагрузки кода по HUP)
+preload_app = os.environ.get('GUNICORN_PRELOAD', '1') == '1'
+
+
+def when_ready(server):
+    if not preload_app:
+        return
+    # Тяжёлые библиотеки, которые в приложении импортируются лениво, подгружаем в мастере заранее:
+    # после fork их страницы общие для всех воркеров, а первый рендер/загрузка не ждут импорта
+    import bleach  # noqa: F401
+    import markdown  # noqa: F401
+    from PIL import Image  # noqa: F401
+    # Объекты, созданные до fork, исключаются из сборки мусора: обход gc не трогает их счётчики
+    # и не копирует общие страницы памяти в каждый воркер
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    if not preload_app:
+        return
+    # Соединения пулов (основная БД и реплика), открытые в мастере, нельзя использовать из нескольких процессов
+    from app import app
+    from extensions import db
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
+
+
+def worker_exit(server, worker):
+    # Дописываем накопленные просмотры до завершения воркера (PAGE_VIEW_RECORDING='buffered')
+    import tracking
+    tracking.recorder.stop()
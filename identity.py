@@ -0,0 +1,64 @@
+# electronic_library/identity.py
+# Загрузка текущего пользователя для Flask-Login: пользователь и его роль читаются одним
+# запросом с JOIN и кэшируются в воркере на USER_CACHE_SECONDS. Каждый запрос получает свою
+# отсоединённую от сессии копию (колонки + роль): она не устаревает после commit в обработчике,
+# поэтому обращения к current_user.role не порождают повторных SELECT.
+# Изменения User и Role сбрасывают кэш этого воркера, остальные воркеры обновятся по TTL.
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import joinedload, make_transient_to_detached
+from sqlalchemy.orm.attributes import set_committed_value
+
+from app import app
+from models import User, Role
+from cache import TTLCache
+
+_users = TTLCache(maxsize=app.config['USER_CACHE_MAX_ITEMS'], ttl=app.config['USER_CACHE_SECONDS'])
+
+
+def _detached_copy(obj):
+    # Копия только с колонками: её можно безопасно разделять между потоками и сессиями
+    model = type(obj)
+    copy = model(**{column.key: getattr(obj, column.key) for column in inspect(model).column_attrs})
+    make_transient_to_detached(copy)
+    return copy
+
+
+def _snapshot(user):
+    role = _detached_copy(user.role)
+    snapshot = _detached_copy(user)
+    # Без событий backref: в Role.users не должна появиться незагруженная коллекция
+    set_committed_value(snapshot, 'role', role)
+    return snapshot
+
+
+def load_user(user_id):
+    user_id = int(user_id)
+    snapshot = _users.get(user_id)
+    if snapshot is None:
+        user = User.query.options(joinedload(User.role)).filter_by(id=user_id).first()
+        if user is None:
+            return None
+        snapshot = _snapshot(user)
+        _users.set(user_id, snapshot)
+    # Общий снимок не отдаётся наружу: изменения в одном запросе не должны быть видны другим
+    return _snapshot(snapshot)
+
+
+def invalidate(user_id=None):
+    if user_id is None:
+        _users.clear()
+    else:
+        _users.delete(user_id)
+
+
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def _user_changed(mapper, connection, target):
+    invalidate(target.id)
+
+
+@event.listens_for(Role, 'after_update')
+@event.listens_for(Role, 'after_delete')
+def _role_changed(mapper, connection, target):
+    invalidate()
@@ -0,0 +1,29 @@
+# electronic_library/localdb.py
+# Служебные файлы SQLite, общие для всех воркеров gunicorn на одной машине
+# (кэш фрагментов, счётчики лимита просмотров). Соединение открывается на каждый поток
+# и заново после fork: соединение SQLite, унаследованное от родителя, использовать нельзя.
+
+import os
+import sqlite3
+import threading
+
+
+class LocalSQLite:
+    def __init__(self, path, schema=()):
+        self.path = path
+        self.schema = schema  # CREATE TABLE IF NOT EXISTS ... — выполняются при открытии соединения
+        self._local = threading.local()
+
+    def connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)  # instance/ нет в свежем клоне
+            # timeout — ожидание блокировки записи другим воркером вместо ошибки "database is locked"
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            for statement in self.schema:
+                conn.execute(statement)
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
@@ -3,6 +3,8 @@
 from datetime import datetime, date
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_login import UserMixin
+from sqlalchemy import event, func
+from sqlalchemy.orm import joinedload, selectinload
 # Импортируем db из extensions.py
 from extensions import db
 
@@ -43,9 +45,14 @@ class User(UserMixin, db.Model):
         return check_password_hash(self.password_hash, password)
 
     def get_full_name(self):
-        full_name = f"{self.first_name} {self.last_name}"
-        if self.patronymic:
-            full_name += f" {self.patronymic}"
+        return User.format_full_name(self.first_name, self.last_name, self.patronymic)
+
+    @staticmethod
+    def format_full_name(first_name, last_name, patronymic=None):
+        # Используется и там, где ФИО выбирается колонками без загрузки объекта User (экспорт журнала)
+        full_name = f"{first_name} {last_name}"
+        if patronymic:
+            full_name += f" {patronymic}"
         return full_name
 
     def __repr__(self):
@@ -63,35 +70,76 @@ class Book(db.Model):
     __tablename__ = 'books'
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(255), nullable=False)
-    short_description = db.Column(db.Text, nullable=False)
+    short_description = db.Column(db.Text, nullable=False) # HTML, готовый к выводу (см. rendering.py)
+    short_description_source = db.Column(db.Text, nullable=True) # Исходный Markdown
+    short_description_hash = db.Column(db.String(64), nullable=True) # Хэш исходника, по которому построен HTML
     publication_year = db.Column(db.Integer, nullable=False)
     publisher = db.Column(db.String(255), nullable=False)
     author = db.Column(db.String(255), nullable=False)
     pages = db.Column(db.Integer, nullable=False)
-
-    genres = db.relationship('Genre', secondary=book_genres, lazy='subquery', backref=db.backref('books', lazy=True))
-    cover = db.relationship('Cover', backref='book', lazy=True, uselist=False)
-    reviews = db.relationship('Review', backref='book', lazy=True)
-    page_views = db.relationship('PageView', backref='book', lazy=True)
+    # Денормализованные агрегаты рецензий, чтобы не загружать все рецензии при каждом рендере
+    review_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    rating_sum = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # Растёт при каждом изменении книги, её жанров или рецензий: из него строятся ETag в API (api.py)
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+
+    genres = db.relationship('Genre', secondary=book_genres, lazy=True, backref=db.backref('books', lazy=True))
+    # Обложка — общий файл, адресуемый по содержимому; несколько книг могут ссылаться на один Cover
+    cover_id = db.Column(db.Integer, db.ForeignKey('covers.id'), nullable=True, index=True)
+    cover = db.relationship('Cover', lazy=True)
+    # Рецензии и просмотры удаляются вместе с книгой массовым DELETE (см. delete_book), а не по одной
+    reviews = db.relationship('Review', backref='book', lazy=True, passive_deletes=True)
+    page_views = db.relationship('PageView', backref='book', lazy=True, passive_deletes=True)
+
+    @staticmethod
+    def listing_options():
+        # Единая стратегия загрузки для списков книг: обложка подтягивается JOIN-ом,
+        # жанры одним SELECT ... IN на всю страницу, рейтинг берётся из колонок книги
+        return (joinedload(Book.cover), selectinload(Book.genres))
 
     def get_average_rating(self):
-        if self.reviews:
-            return round(sum(review.rating for review in self.reviews) / len(self.reviews), 1)
+        if self.review_count:
+            return round(self.rating_sum / self.review_count, 1)
         return 0.0
 
     def get_review_count(self):
-        return len(self.reviews)
+        return self.review_count
+
+    def register_review(self, rating):
+        # Инкремент выполняется в SQL (UPDATE ... SET review_count = review_count + 1)
+        # в той же транзакции, что и INSERT рецензии, поэтому параллельные рецензии не теряются
+        self.review_count = Book.review_count + 1
+        self.rating_sum = Book.rating_sum + rating
+
+    @staticmethod
+    def recalculate_ratings():
+        # Полный пересчёт агрегатов по таблице reviews (восстановление после рассинхронизации)
+        count_subquery = db.select(func.count(Review.id)).where(Review.book_id == Book.id).scalar_subquery()
+        sum_subquery = db.select(func.coalesce(func.sum(Review.rating), 0)).where(Review.book_id == Book.id).scalar_subquery()
+        result = db.session.execute(db.update(Book).values(review_count=count_subquery, rating_sum=sum_subquery,
+                                                           version=Book.version + 1))
+        return result.rowcount
 
     def __repr__(self):
         return f"<Book {self.title}>"
 
+@event.listens_for(Book, 'before_update')
+def _bump_book_version(mapper, connection, target):
+    # Срабатывает и когда изменились только жанры (связь many-to-many): версия всё равно растёт.
+    # Инкремент в SQL, чтобы параллельные изменения не потеряли друг друга
+    target.version = Book.version + 1
+
 class Cover(db.Model):
+    # Файл изображения хранится один раз на каждое уникальное содержимое (md5_hash),
+    # ref_count — число книг, ссылающихся на него через books.cover_id (см. covers.py)
     __tablename__ = 'covers'
     id = db.Column(db.Integer, primary_key=True)
     filename = db.Column(db.String(255), nullable=False)
     mime_type = db.Column(db.String(255), nullable=False)
     md5_hash = db.Column(db.String(32), unique=True, nullable=False)
-    book_id = db.Column(db.Integer, db.ForeignKey('books.id', ondelete='CASCADE'), nullable=False)
+    ref_count = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+    # Уменьшенные копии (thumbnails.py) построены — шаблоны могут отдавать srcset
+    thumbnails_ready = db.Column(db.Boolean, nullable=False, default=False, server_default='0')
 
     def __repr__(self):
         return f"<Cover {self.filename}>"
@@ -102,9 +150,16 @@ class Review(db.Model):
     book_id = db.Column(db.Integer, db.ForeignKey('books.id', ondelete='CASCADE'), nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
     rating = db.Column(db.Integer, nullable=False)
-    text = db.Column(db.Text, nullable=False)
+    text = db.Column(db.Text, nullable=False) # HTML, готовый к выводу (см. rendering.py)
+    text_source = db.Column(db.Text, nullable=True) # Исходный Markdown
+    text_hash = db.Column(db.String(64), nullable=True)
     created_at = db.Column(db.TIMESTAMP, default=datetime.utcnow, nullable=False)
 
+    # Страница рецензий книги (новые первыми, keyset по created_at, id) читается по индексу без сортировки
+    __table_args__ = (
+        db.Index('ix_reviews_book_created', 'book_id', 'created_at', 'id'),
+    )
+
     def __repr__(self):
         return f"<Review for Book {self.book_id} by User {self.user_id}>"
 
@@ -116,5 +171,31 @@ class PageView(db.Model):
     view_time = db.Column(db.TIMESTAMP, default=datetime.utcnow, nullable=False)
     ip_address = db.Column(db.String(45), nullable=False)
 
+    # Индексы под горячие запросы: лимит просмотров книги (по пользователю и по IP),
+    # "недавно просмотренные" (по пользователю и по IP гостя), журнал и статистика (по времени)
+    __table_args__ = (
+        db.Index('ix_page_views_book_user_time', 'book_id', 'user_id', 'view_time'),
+        db.Index('ix_page_views_book_ip_time', 'book_id', 'ip_address', 'view_time'),
+        db.Index('ix_page_views_user_time', 'user_id', 'view_time'),
+        db.Index('ix_page_views_ip_user_time', 'ip_address', 'user_id', 'view_time'),
+        db.Index('ix_page_views_time_user', 'view_time', 'user_id'),
+        db.Index('ix_page_views_time_id', 'view_time', 'id'),  # Keyset-пагинация журнала по (view_time, id)
+    )
+
+    def __repr__(self):
+        return f"<PageView Book: {self.book_id}, User: {self.user_id}, IP: {self.ip_address}, Time: {self.view_time}>"
+
+class BookViewDaily(db.Model):
+    # Суточная свёртка page_views: поддерживается инкрементально при каждой записи просмотра
+    __tablename__ = 'book_view_daily'
+    book_id = db.Column(db.Integer, db.ForeignKey('books.id', ondelete='CASCADE'), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    views = db.Column(db.Integer, nullable=False, default=0)
+    authenticated_views = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        db.Index('ix_book_view_daily_day', 'day', 'book_id'),
+    )
+
     def __repr__(self):
-        return f"<PageView Book: {self.book_id}, User: {self.user_id}, IP: {self.ip_address}, Time: {self.view_time}>"
\ No newline at end of file
+        return f"<BookViewDaily Book: {self.book_id}, Day: {self.day}, Views: {self.views}>"
\ No newline at end of file
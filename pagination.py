@@ -0,0 +1,92 @@
+# electronic_library/pagination.py
+# Keyset-пагинация (по курсору) для длинных лент, отсортированных по убыванию (ключ, id).
+# В отличие от OFFSET стоимость страницы не зависит от её номера, а COUNT(*) не нужен.
+
+import base64
+import binascii
+import json
+from datetime import datetime
+from sqlalchemy import and_, or_
+
+
+class KeysetPage:
+    def __init__(self, items, per_page, offset, next_cursor, prev_cursor):
+        self.items = items
+        self.per_page = per_page
+        self.offset = offset  # Сколько записей выше этой страницы (для сквозной нумерации)
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+
+def _to_json(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def encode_cursor(values, offset):
+    payload = json.dumps({'k': [_to_json(value) for value in values], 'n': offset}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, columns):
+    """Возвращает (значения ключа, смещение) или None, если курсор пустой или повреждён."""
+    if not cursor:
+        return None
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        values = []
+        for column, value in zip(columns, payload['k'], strict=True):
+            if column.type.python_type is datetime:
+                value = datetime.fromisoformat(value)
+            values.append(value)
+        return values, int(payload['n'])
+    except (ValueError, KeyError, TypeError, binascii.Error, NotImplementedError):
+        return None
+
+
+def _beyond(columns, values, descending):
+    # (a, b) < (x, y) в развёрнутом виде — так его понимают индексы и SQLite, и MySQL
+    column, value = columns[0], values[0]
+    if len(columns) == 1:
+        return column < value if descending else column > value
+    strict = column < value if descending else column > value
+    return or_(strict, and_(column == value, _beyond(columns[1:], values[1:], descending)))
+
+
+def keyset_paginate(query, columns, per_page, after=None, before=None):
+    """Страница запроса, упорядоченного по убыванию columns (последняя колонка — уникальный id).
+
+    after — курсор для перехода к более старым записям, before — к более новым.
+    """
+    def key_of(item):
+        return [getattr(item, column.key) for column in columns]
+
+    position = decode_cursor(before, columns)
+    if position is not None:
+        values, offset = position
+        rows = query.filter(_beyond(columns, values, descending=False)) \
+            .order_by(*[column.asc() for column in columns]).limit(per_page + 1).all()
+        has_newer = len(rows) > per_page
+        items = list(reversed(rows[:per_page]))
+        offset = max(offset - len(items), 0)
+        prev_cursor = encode_cursor(key_of(items[0]), offset) if has_newer and items else None
+        next_cursor = encode_cursor(key_of(items[-1]), offset + len(items)) if items else None
+        return KeysetPage(items, per_page, offset, next_cursor, prev_cursor)
+
+    position = decode_cursor(after, columns)
+    offset = 0
+    if position is not None:
+        values, offset = position
+        query = query.filter(_beyond(columns, values, descending=True))
+    rows = query.order_by(*[column.desc() for column in columns]).limit(per_page + 1).all()
+    items = rows[:per_page]
+    next_cursor = encode_cursor(key_of(items[-1]), offset + len(items)) if len(rows) > per_page else None
+    prev_cursor = encode_cursor(key_of(items[0]), offset) if offset > 0 and items else None
+    return KeysetPage(items, per_page, offset, next_cursor, prev_cursor)
@@ -0,0 +1,139 @@
+# electronic_library/ratelimit.py
+# Ограничение MAX_VIEWS_PER_DAY без чтения page_views на каждый просмотр:
+# счётчики (книга, пользователь или IP, день) хранятся в общем для всех воркеров gunicorn файле SQLite
+# или, для запуска в один процесс, в памяти.
+
+import threading
+from collections import OrderedDict
+from datetime import datetime, time, timezone
+from sqlalchemy import func
+
+from extensions import db
+from app import app
+from models import PageView
+from localdb import LocalSQLite
+
+
+def viewer_key(user_id, ip_address):
+    # Лимит считается по пользователю, а для гостей — по IP
+    return f'user:{user_id}' if user_id is not None else f'ip:{ip_address}'
+
+
+class MemoryCounterBackend:
+    """Счётчики в памяти процесса с ограничением числа ключей (LRU).
+
+    Только для одного воркера: у каждого процесса свои счётчики, и вытесненный ключ начинает счёт заново.
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._counts = OrderedDict()
+        self._lock = threading.Lock()
+
+    def increment_if_below(self, key, limit):
+        with self._lock:
+            count = self._counts.get(key, 0)
+            if count >= limit:
+                self._counts.move_to_end(key)
+                return False
+            self._counts[key] = count + 1
+            self._counts.move_to_end(key)
+            while len(self._counts) > self.maxsize:
+                self._counts.popitem(last=False)
+            return True
+
+    def warm(self, items):
+        with self._lock:
+            for key, count in items:
+                self._counts[key] = max(self._counts.get(key, 0), count)
+
+    def purge_before(self, day):
+        with self._lock:
+            for key in [key for key in self._counts if key[2] < day]:
+                del self._counts[key]
+
+
+class SQLiteCounterBackend:
+    """Счётчики в отдельном файле SQLite, общем для всех воркеров на одной машине."""
+
+    SCHEMA = (
+        'CREATE TABLE IF NOT EXISTS view_counters ('
+        'book_id INTEGER NOT NULL, viewer TEXT NOT NULL, day TEXT NOT NULL, '
+        'count INTEGER NOT NULL, PRIMARY KEY (book_id, viewer, day))',
+    )
+
+    def __init__(self, path):
+        self._db = LocalSQLite(path, self.SCHEMA)
+
+    def increment_if_below(self, key, limit):
+        if limit <= 0:
+            return False
+        book_id, viewer, day = key
+        # Один атомарный UPSERT: счётчик растёт, только пока не достиг лимита
+        cursor = self._db.connection().execute(
+            'INSERT INTO view_counters (book_id, viewer, day, count) VALUES (?, ?, ?, 1) '
+            'ON CONFLICT (book_id, viewer, day) DO UPDATE SET count = count + 1 WHERE count < ?',
+            (book_id, viewer, day.isoformat(), limit))
+        return cursor.rowcount > 0
+
+    def warm(self, items):
+        self._db.connection().executemany(
+            'INSERT INTO view_counters (book_id, viewer, day, count) VALUES (?, ?, ?, ?) '
+            'ON CONFLICT (book_id, viewer, day) DO UPDATE SET count = max(count, excluded.count)',
+            [(book_id, viewer, day.isoformat(), count) for (book_id, viewer, day), count in items])
+
+    def purge_before(self, day):
+        self._db.connection().execute('DELETE FROM view_counters WHERE day < ?', (day.isoformat(),))
+
+
+class ViewRateLimiter:
+    def __init__(self, app):
+        self.app = app
+        self._backend = None
+        self._day = None
+        self._lock = threading.Lock()
+
+    def _create_backend(self):
+        if self.app.config['VIEW_LIMIT_BACKEND'] == 'sqlite':
+            return SQLiteCounterBackend(self.app.config['VIEW_LIMIT_DB'])
+        return MemoryCounterBackend(self.app.config['VIEW_LIMIT_MAX_KEYS'])
+
+    def _today_counts(self, day):
+        # Прогрев счётчиков: сколько просмотров уже записано сегодня (один запрос на процесс)
+        day_start = datetime.combine(day, time.min, tzinfo=timezone.utc)
+        rows = db.session.query(PageView.book_id, PageView.user_id, PageView.ip_address, func.count(PageView.id)) \
+            .filter(PageView.view_time >= day_start) \
+            .group_by(PageView.book_id, PageView.user_id, PageView.ip_address).all()
+        counts = {}
+        for book_id, user_id, ip_address, count in rows:
+            key = (book_id, viewer_key(user_id, ip_address), day)
+            counts[key] = counts.get(key, 0) + count
+        return counts.items()
+
+    def _prepare(self, day):
+        with self._lock:
+            if self._backend is None:
+                self._backend = self._create_backend()
+                self._backend.warm(self._today_counts(day))
+            elif self._day != day:
+                self._backend.purge_before(day)  # Новые сутки — вчерашние счётчики больше не нужны
+            self._day = day
+            return self._backend
+
+    def hit(self, book_id, user_id, ip_address, view_time):
+        """Засчитывает просмотр и возвращает True, если лимит на сегодня ещё не исчерпан."""
+        day = view_time.date()
+        with self._lock:  # reset() и смена суток меняют _backend и _day вместе
+            backend = self._backend if self._day == day else None
+        if backend is None:
+            backend = self._prepare(day)
+        return backend.increment_if_below((book_id, viewer_key(user_id, ip_address), day),
+                                          self.app.config['MAX_VIEWS_PER_DAY'])
+
+    def reset(self):
+        with self._lock:
+            self._backend = None
+            self._day = None
+
+
+view_limiter = ViewRateLimiter(app)
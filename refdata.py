@@ -0,0 +1,53 @@
+# electronic_library/refdata.py
+# Справочные данные для форм: жанры и годы издания.
+# Загружаются один раз на воркер и перечитываются, когда меняется поколение 'reference'
+# (его увеличивают изменения книг и жанров) или истекает REFERENCE_DATA_SECONDS —
+# на случай бэкенда кэша 'memory', где поколение видно только своему воркеру.
+
+import threading
+import time
+
+from extensions import db
+from app import app
+from models import Book, Genre
+from fragments import fragment_cache
+
+NAMESPACE = 'reference'
+
+
+class ReferenceData:
+    def __init__(self, app):
+        self.app = app
+        self._data = None
+        self._version = None
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+
+    def _load(self):
+        years = db.session.query(Book.publication_year).distinct().order_by(Book.publication_year.desc()).all()
+        return {
+            'genres': [(g.id, g.name) for g in Genre.query.order_by(Genre.name).all()],
+            'years': [(y[0], str(y[0])) for y in years],
+        }
+
+    def _current(self):
+        version = fragment_cache.generation(NAMESPACE)
+        expired = time.monotonic() - self._loaded_at > fragment_cache.local_ttl(self.app.config['REFERENCE_DATA_SECONDS'])
+        if self._data is None or version != self._version or expired:
+            with fragment_cache.fresh_reads([NAMESPACE]):
+                data = self._load()
+            with self._lock:
+                self._data, self._version, self._loaded_at = data, version, time.monotonic()
+        return self._data
+
+    def genre_choices(self):
+        return self._current()['genres']
+
+    def year_choices(self):
+        return self._current()['years']
+
+    def invalidate(self):
+        fragment_cache.invalidate(NAMESPACE)
+
+
+reference_data = ReferenceData(app)
@@ -0,0 +1,69 @@
+# electronic_library/rendering.py
+# Преобразование Markdown в безопасный HTML для описаний книг и рецензий.
+# HTML строится один раз при сохранении и хранится рядом с исходным текстом вместе с хэшем,
+# шаблоны выводят только сохранённый HTML — при просмотре страниц Markdown не разбирается.
+
+import hashlib
+import threading
+
+# Профили отличаются набором тегов, разрешённых сверх bleach.sanitizer.ALLOWED_TAGS
+PROFILES = {
+    'description': ['p', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'ul', 'ol', 'li', 'em', 'strong',
+                    'blockquote', 'code', 'pre', 'hr', 'br', 'a', 'img'],
+    'review': ['p', 'br', 'em', 'strong', 'blockquote', 'code', 'pre'],
+}
+
+# Увеличивается при изменении профилей или расширений Markdown: хэши старых записей
+# перестают совпадать, и render-markdown перестраивает их HTML
+RENDERER_VERSION = 1
+
+# Экземпляры Markdown и Cleaner не потокобезопасны, поэтому у каждого потока свои
+_local = threading.local()
+
+
+def _renderer(profile):
+    renderers = getattr(_local, 'renderers', None)
+    if renderers is None:
+        renderers = _local.renderers = {}
+    if profile not in renderers:
+        # bleach и markdown импортируются при первом рендере: в большинстве запросов (чтение страниц)
+        # они не нужны, а их импорт заметно удлиняет запуск каждого воркера
+        import bleach
+        import markdown
+        renderers[profile] = (
+            markdown.Markdown(),
+            bleach.Cleaner(tags=list(bleach.sanitizer.ALLOWED_TAGS) + PROFILES[profile],
+                           attributes=bleach.sanitizer.ALLOWED_ATTRIBUTES),
+        )
+    return renderers[profile]
+
+
+def render(profile, source):
+    md, cleaner = _renderer(profile)
+    return cleaner.clean(md.reset().convert(source))
+
+
+def content_hash(profile, source):
+    return hashlib.sha256(f'{profile}:{RENDERER_VERSION}:{source}'.encode()).hexdigest()
+
+
+def store(obj, field, profile, source):
+    """Сохраняет в obj исходный текст (field_source), HTML (field) и хэш (field_hash).
+
+    Если хэш не изменился, HTML не перестраивается. Возвращает True, если HTML обновлён.
+    """
+    digest = content_hash(profile, source)
+    setattr(obj, f'{field}_source', source)
+    if getattr(obj, f'{field}_hash') == digest:
+        return False
+    setattr(obj, field, render(profile, source))
+    setattr(obj, f'{field}_hash', digest)
+    return True
+
+
+def set_book_description(book, source):
+    return store(book, 'short_description', 'description', source)
+
+
+def set_review_text(review, source):
+    return store(review, 'text', 'review', source)
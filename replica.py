@@ -0,0 +1,116 @@
+# electronic_library/replica.py
+# Разделение чтения и записи. Маршруты, отмеченные @replica_reads (каталог, статистика, экспорт),
+# читают с реплики (bind 'replica' в SQLALCHEMY_BINDS); всё остальное и любая запись идут в основную БД.
+# Чтобы пользователь сразу видел свои изменения, после изменяющего запроса (POST и т. п. с записью в БД)
+# его запросы REPLICA_STICKY_SECONDS секунд читают с основной БД. Отметка хранится в сессии Flask.
+# Для локальной проверки реплика — второй файл SQLite, который копирует команда sync-replica.
+
+import sqlite3
+import time
+from contextlib import contextmanager
+from functools import wraps
+from flask import g, has_app_context, has_request_context, request, session
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+from extensions import RoutingSession, REPLICA_BIND
+from app import app
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+def replica_enabled():
+    return REPLICA_BIND in app.config['SQLALCHEMY_BINDS']
+
+
+def sticky_to_primary():
+    return has_request_context() and session.get('db_primary_until', 0) > time.time()
+
+
+@contextmanager
+def use_replica():
+    """Чтения в этом контексте приложения идут на реплику (до первой записи)."""
+    previous = g.get('db_replica_reads', False)
+    g.db_replica_reads = replica_enabled() and not sticky_to_primary()
+    try:
+        yield
+    finally:
+        g.db_replica_reads = previous
+
+
+@contextmanager
+def use_primary():
+    """Чтения в этом контексте идут в основную БД, даже если маршрут отмечен @replica_reads.
+
+    Нужно для чтений, которые должны видеть только что сделанные записи: свои просмотры на главной
+    и промахи кэшей сразу после invalidate() (см. FragmentCache.fresh_reads).
+    """
+    if not has_app_context():
+        yield
+        return
+    previous = g.get('db_replica_reads', False)
+    g.db_replica_reads = False
+    try:
+        yield
+    finally:
+        g.db_replica_reads = previous
+
+
+def replica_reads(fn):
+    """Декоратор маршрута: его чтения можно обслужить с реплики."""
+    @wraps(fn)
+    def decorated_view(*args, **kwargs):
+        # Отметка не снимается по выходу: потоковые ответы (stream_with_context) читают уже после return
+        g.db_replica_reads = replica_enabled() and not sticky_to_primary()
+        return fn(*args, **kwargs)
+    return decorated_view
+
+
+def _mark_write():
+    if has_app_context():
+        g.db_wrote = True
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _after_flush(session, flush_context):
+    _mark_write()
+
+
+@event.listens_for(RoutingSession, 'do_orm_execute')
+def _on_execute(orm_execute_state):
+    # Массовые UPDATE/DELETE/INSERT выполняются без flush
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        _mark_write()
+
+
+@app.after_request
+def stick_after_write(response):
+    # Просмотр страницы книги (GET) тоже пишет в БД, но это не изменение, которое пользователь ждёт увидеть
+    if replica_enabled() and g.get('db_wrote') and request.method not in SAFE_METHODS:
+        session['db_primary_until'] = time.time() + app.config['REPLICA_STICKY_SECONDS']
+    return response
+
+
+def sqlite_path(uri):
+    url = make_url(uri)
+    if url.get_backend_name() != 'sqlite' or not url.database or url.database == ':memory:':
+        return None
+    return url.database
+
+
+def sync_replica():
+    """Копирует основную SQLite-БД в файл реплики через backup API; возвращает время копирования в секундах.
+
+    Копия согласована (снимок одной транзакции), читатели реплики во время копирования не получают ошибок.
+    """
+    primary_path = sqlite_path(app.config['SQLALCHEMY_DATABASE_URI'])
+    replica_path = sqlite_path(app.config['SQLALCHEMY_BINDS'][REPLICA_BIND])
+    started = time.perf_counter()
+    source = sqlite3.connect(primary_path, timeout=30)
+    target = sqlite3.connect(replica_path, timeout=30)
+    try:
+        source.backup(target)
+    finally:
+        target.close()
+        source.close()
+    return time.perf_counter() - started
@@ -1,22 +1,30 @@
 # electronic_library/routes.py
 
-from flask import render_template, request, redirect, url_for, flash, send_from_directory, abort, make_response
+from flask import render_template, request, redirect, url_for, flash, abort, Response, stream_with_context, send_file, jsonify
 from flask_login import login_user, logout_user, current_user, login_required # <-- Теперь login_required здесь!
-from sqlalchemy import func, or_
-from datetime import datetime, timedelta
+from sqlalchemy.orm import joinedload
+from datetime import datetime
 import os
-import hashlib
-import bleach
-import markdown
-import pandas as pd
-from io import StringIO
 from functools import wraps # <-- Добавим functools.wraps сюда, так как декоратор будет здесь.
 
 from extensions import db # db импортируем из extensions.py
 from app import app # app импортируем из app.py, но без roles_required оттуда
-from models import User, Book, Cover, Genre, Review, PageView
+from models import User, Book, Genre, Review, PageView, BookViewDaily
 from forms import *
-from config import Config
+import search
+import tracking
+from ratelimit import view_limiter
+import exports
+import stats
+from exports import export_jobs
+from pagination import keyset_paginate
+from uploads import stage_upload
+import covers
+import rendering
+from thumbnails import thumbnail_workers
+from fragments import fragment_cache, book_namespace
+from refdata import reference_data
+from replica import replica_reads, use_primary
 
 # Вспомогательная функция для проверки разрешенных расширений файлов
 def allowed_file(filename):
@@ -40,6 +48,23 @@ def roles_required(*roles):
     return wrapper
 
 
+def statistics_filter():
+    """Фильтр статистики и экспорта из строки запроса.
+
+    Возвращает форму, проверенный диапазон (date_from, date_to) — строки ГГГГ-ММ-ДД или None —
+    и filter_args с непустыми границами для ссылок пагинации.
+    """
+    filter_form = StatisticsFilterForm(request.args)
+    date_from, date_to = filter_form.date_range() if filter_form.validate() else (None, None)
+    filter_args = {name: value for name, value in (('date_from', date_from), ('date_to', date_to)) if value}
+    return filter_form, (date_from, date_to), filter_args
+
+
+def viewer_role():
+    # Роль определяет набор кнопок в кэшируемых фрагментах (редактирование/удаление); у гостей своя группа
+    return current_user.role.name if current_user.is_authenticated else 'anonymous'
+
+
 # --- Маршруты аутентификации ---
 
 @app.route('/login', methods=['GET', 'POST'])
@@ -68,64 +93,60 @@ def logout():
 # --- Главная страница ---
 
 @app.route('/')
+@replica_reads
 def index():
     page = request.args.get('page', 1, type=int)
-    search_form = BookSearchForm(request.args)
-    # Важно: для динамических choices в search_form, нужно переопределить их здесь,
-    # так как форма создается до того, как Book будет полностью загружена
-    search_form.publication_year.choices = [(y[0], str(y[0])) for y in db.session.query(Book.publication_year).distinct().order_by(Book.publication_year.desc()).all()]
-    search_form.genres.choices = [(g.id, g.name) for g in Genre.query.order_by(Genre.name).all()]
-
-
-    query = Book.query.order_by(Book.publication_year.desc())
-
-    # Применяем фильтры поиска
-    if search_form.validate():
-        if search_form.title.data:
-            query = query.filter(Book.title.ilike(f'%{search_form.title.data}%'))
-        if search_form.genres.data:
-            # Для фильтрации по жанрам через many-to-many связь
-            query = query.join(Book.genres).filter(Genre.id.in_(search_form.genres.data))
-        if search_form.publication_year.data:
-            query = query.filter(Book.publication_year.in_(search_form.publication_year.data))
-        if search_form.pages_from.data is not None:
-            query = query.filter(Book.pages >= search_form.pages_from.data)
-        if search_form.pages_to.data is not None:
-            query = query.filter(Book.pages <= search_form.pages_to.data)
-        if search_form.author.data:
-            query = query.filter(Book.author.ilike(f'%{search_form.author.data}%'))
-
-    books_pagination = query.paginate(page=page, per_page=app.config['PAGINATION_PER_PAGE'], error_out=False)
-    books = books_pagination.items
+    search_form = BookSearchForm(request.args) # Варианты жанров и годов форма берёт из справочника воркера
 
-    # --- Вариант 4: Популярные книги ---
-    popular_books = []
-    # Дата 3 месяца назад
-    three_months_ago = datetime.datetime.now(datetime.timezone.utc) - timedelta(days=30 * app.config['POPULAR_BOOKS_PERIOD_MONTHS'])
-    # Присоединяем Book к PageView и фильтруем по времени, группируем по книге
-    popular_books_query = db.session.query(
-        Book, func.count(PageView.id).label('view_count')
-    ).join(PageView).filter(PageView.view_time >= three_months_ago).group_by(Book.id).order_by(func.count(PageView.id).desc()).limit(5).all()
-    popular_books = [book for book, count in popular_books_query]
+    # Фильтры, которые реально применяются, в нормализованном виде: ключ кэша каталога и ссылки пагинации
+    filter_args = search_form.filter_args() if search_form.validate() else {}
+
+    def render_catalog():
+        query = Book.query.options(*Book.listing_options())
+        order_by = [Book.publication_year.desc()]
+
+        # Применяем фильтры поиска (те же, что у /api/books)
+        query, rank = search.filter_books(query, filter_args)
+        if rank is not None:
+            order_by.insert(0, rank)
 
+        books_pagination = query.order_by(*order_by).paginate(page=page, per_page=app.config['PAGINATION_PER_PAGE'], error_out=False)
+        return render_template('_catalog.html', books=books_pagination.items, pagination=books_pagination,
+                               filter_args=filter_args)
+
+    # --- Вариант 4: Популярные книги ---
+    def render_popular():
+        popular_books = []
+        # ID популярных книг считаются по суточной свёртке за последние 3 месяца и кэшируются в процессе
+        popular_ids = tracking.popular_book_ids(limit=5)
+        if popular_ids:
+            books_by_id = {book.id: book for book in Book.query.options(*Book.listing_options()).filter(Book.id.in_(popular_ids))}
+            popular_books = [books_by_id[book_id] for book_id in popular_ids if book_id in books_by_id]
+        return render_template('_popular_books.html', popular_books=popular_books)
+
+    # Список книг и популярные книги одинаковы для всех посетителей с одной ролью — берутся из кэша фрагментов
+    catalog_html = fragment_cache.get_or_render(['catalog'], ['catalog', filter_args, page, viewer_role()], render_catalog)
+    popular_html = fragment_cache.get_or_render(['catalog'], ['popular'], render_popular)
 
     # --- Вариант 4: Недавно просмотренные книги ---
+    # Просмотр (GET) не закрепляет сессию за основной БД, поэтому свои просмотры читаются оттуда напрямую:
+    # реплика могла ещё не получить только что открытую книгу
     recently_viewed_books = []
-    if current_user.is_authenticated:
-        # Для аутентифицированного пользователя
-        recent_views = PageView.query.filter_by(user_id=current_user.id).order_by(PageView.view_time.desc()).limit(5).all()
-        recently_viewed_books = [pv.book for pv in recent_views if pv.book is not None] # Добавлена проверка на None, если книга была удалена
-    else:
-        # Для неаутентифицированного пользователя по IP
-        user_ip = request.remote_addr
-        recent_views = PageView.query.filter(PageView.ip_address == user_ip, PageView.user_id == None).order_by(PageView.view_time.desc()).limit(5).all()
-        recently_viewed_books = [pv.book for pv in recent_views if pv.book is not None]
+    with use_primary():
+        if current_user.is_authenticated:
+            # Для аутентифицированного пользователя
+            recent_views = PageView.query.options(joinedload(PageView.book)).filter_by(user_id=current_user.id).order_by(PageView.view_time.desc()).limit(5).all()
+            recently_viewed_books = [pv.book for pv in recent_views if pv.book is not None] # Добавлена проверка на None, если книга была удалена
+        else:
+            # Для неаутентифицированного пользователя по IP
+            user_ip = request.remote_addr
+            recent_views = PageView.query.options(joinedload(PageView.book)).filter(PageView.ip_address == user_ip, PageView.user_id == None).order_by(PageView.view_time.desc()).limit(5).all()
+            recently_viewed_books = [pv.book for pv in recent_views if pv.book is not None]
 
     return render_template('index.html',
-                           books=books,
-                           pagination=books_pagination,
+                           catalog_html=catalog_html,
+                           popular_html=popular_html,
                            search_form=search_form,
-                           popular_books=popular_books,
                            recently_viewed_books=recently_viewed_books,
                            title='Главная')
 
@@ -139,22 +160,18 @@ def add_book():
     form.cover_file.validators = [FileRequired(), FileAllowed(app.config['ALLOWED_EXTENSIONS'], 'Только изображения!')]
 
     if form.validate_on_submit():
+        upload = saved_path = None
         # Начало транзакции
         try:
-            # Санитизация описания
-            sanitized_description = bleach.clean(markdown.markdown(form.short_description.data),
-                                                 tags=list(bleach.sanitizer.ALLOWED_TAGS) + ['p', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'ul', 'ol', 'li', 'em', 'strong', 'blockquote', 'code', 'pre', 'hr', 'br', 'a', 'img'],
-                                                 attributes=bleach.sanitizer.ALLOWED_ATTRIBUTES)
-
-
             new_book = Book(
                 title=form.title.data,
-                short_description=sanitized_description,
                 publication_year=form.publication_year.data,
                 publisher=form.publisher.data,
                 author=form.author.data,
                 pages=form.pages.data
             )
+            # Markdown описания преобразуется и санитизируется один раз, HTML хранится в книге
+            rendering.set_book_description(new_book, form.short_description.data)
             # Добавляем книгу, чтобы получить ID для обложки
             db.session.add(new_book)
             db.session.flush() # Получаем ID новой книги до коммита
@@ -162,46 +179,32 @@ def add_book():
             # Обработка обложки
             file = form.cover_file.data
             if file: # Проверяем, что файл был загружен (не пустая строка или None)
-                file_content = file.read()
-                if not file_content:
-                    raise ValueError("Загруженный файл пуст.")
-                md5_hash = hashlib.md5(file_content).hexdigest()
-                file.seek(0) # Сбросить указатель файла после чтения для хэша
-
-                existing_cover = Cover.query.filter_by(md5_hash=md5_hash).first()
-
-                if existing_cover:
-                    # Изображение уже существует, используем его
-                    # Привязываем существующую обложку к новой книге
-                    existing_cover.book_id = new_book.id
-                    new_book.cover = existing_cover
-                    # Удалять файл не нужно, так как он уже есть
-                else:
-                    # Сохраняем новую обложку
-                    # Используем ID книги как часть имени файла, чтобы гарантировать уникальность и связь
-                    # Получаем расширение файла
-                    _, file_extension = os.path.splitext(file.filename)
-                    filename = f"book_{new_book.id}{file_extension}"
-                    filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                    file.save(filepath)
-
-                    new_cover = Cover(
-                        filename=filename,
-                        mime_type=file.content_type,
-                        md5_hash=md5_hash,
-                        book=new_book
-                    )
-                    db.session.add(new_cover)
+                # Файл пишется во временный файл порциями, MD5 считается по ходу записи
+                upload = stage_upload(file)
+                _, file_extension = os.path.splitext(file.filename)
+                # Одинаковые изображения хранятся один раз: при совпадении хэша книга ссылается
+                # на существующую обложку, а временный файл удаляется
+                new_book.cover, saved_path = covers.store_cover(upload, file.content_type, file_extension)
 
             # Добавляем жанры
             genres = Genre.query.filter(Genre.id.in_(form.genres.data)).all()
             new_book.genres.extend(genres)
+            search.index_book(new_book)
 
             db.session.commit() # Коммит всех изменений
+            fragment_cache.invalidate('catalog')
+            reference_data.invalidate() # Мог появиться новый год издания
+            if saved_path:
+                # Новая обложка: уменьшенные копии строятся в фоне, до их готовности отдаётся оригинал
+                thumbnail_workers.submit(new_book.cover_id)
             flash('Книга успешно добавлена!', 'success')
             return redirect(url_for('view_book', book_id=new_book.id))
         except Exception as e:
             db.session.rollback() # Откатываем изменения в случае ошибки
+            # Файл обложки не должен пережить откат транзакции
+            if upload:
+                upload.discard()
+            covers.discard_file(saved_path)
             flash(f'При сохранении данных возникла ошибка: {e}. Проверьте корректность введённых данных.', 'danger')
             # Передаем форму с заполненными данными обратно
             return render_template('book_form.html', form=form, title='Добавить книгу', action='add')
@@ -222,17 +225,15 @@ def edit_book(book_id):
     # Устанавливаем выбранные жанры
     if request.method == 'GET':
         form.genres.data = [g.id for g in book.genres]
+        # В редакторе — исходный Markdown, а не сохранённый HTML
+        form.short_description.data = book.short_description_source or book.short_description
 
     if form.validate_on_submit():
         # Начало транзакции
         try:
-            # Санитизация описания
-            sanitized_description = bleach.clean(markdown.markdown(form.short_description.data),
-                                                 tags=list(bleach.sanitizer.ALLOWED_TAGS) + ['p', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'ul', 'ol', 'li', 'em', 'strong', 'blockquote', 'code', 'pre', 'hr', 'br', 'a', 'img'],
-                                                 attributes=bleach.sanitizer.ALLOWED_ATTRIBUTES)
-
             book.title = form.title.data
-            book.short_description = sanitized_description
+            # HTML перестраивается, только если исходный Markdown изменился
+            rendering.set_book_description(book, form.short_description.data)
             book.publication_year = form.publication_year.data
             book.publisher = form.publisher.data
             book.author = form.author.data
@@ -242,8 +243,12 @@ def edit_book(book_id):
             book.genres = [] # Очищаем текущие жанры
             selected_genres = Genre.query.filter(Genre.id.in_(form.genres.data)).all()
             book.genres.extend(selected_genres)
+            search.index_book(book)
 
             db.session.commit() # Коммит всех изменений
+            fragment_cache.invalidate('catalog', book_namespace(book.id))
+            reference_data.invalidate()
+            stats.invalidate() # В статистике выводится название книги
             flash('Книга успешно обновлена!', 'success')
             return redirect(url_for('view_book', book_id=book.id))
         except Exception as e:
@@ -263,12 +268,20 @@ def delete_book(book_id):
         return redirect(url_for('index'))
 
     try:
-        # Удаление файла обложки из файловой системы
-        if book.cover and os.path.exists(os.path.join(app.config['UPLOAD_FOLDER'], book.cover.filename)):
-            os.remove(os.path.join(app.config['UPLOAD_FOLDER'], book.cover.filename))
-
+        # Обложка может быть общей с другими книгами: снимаем ссылку, файл удалит сборщик мусора
+        covers.release_cover(book.cover)
+
+        search.remove_book(book.id)
+        # SQLite не выполняет ON DELETE CASCADE без PRAGMA foreign_keys, поэтому чистим явно
+        Review.query.filter_by(book_id=book.id).delete()
+        PageView.query.filter_by(book_id=book.id).delete()
+        BookViewDaily.query.filter_by(book_id=book.id).delete()
         db.session.delete(book)
         db.session.commit()
+        stats.invalidate()
+        fragment_cache.invalidate('catalog', book_namespace(book_id))
+        reference_data.invalidate()
+        covers.collect_garbage()
         flash(f'Книга "{book.title}" успешно удалена!', 'success')
     except Exception as e:
         db.session.rollback()
@@ -278,7 +291,25 @@ def delete_book(book_id):
 
 @app.route('/uploads/<filename>')
 def uploaded_file(filename):
-    return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+    return covers.send_cover_file(app.config['UPLOAD_FOLDER'], filename)
+
+@app.route('/uploads/thumbs/<filename>')
+def cover_thumbnail(filename):
+    return covers.send_cover_file(app.config['THUMBNAIL_FOLDER'], filename)
+
+def review_page(book_id, after=None):
+    """Страница рецензий книги (новые первыми) из кэша фрагментов.
+
+    Возвращает пары [автор, HTML карточки] — чтобы скрыть рецензию текущего пользователя —
+    и курсор следующей страницы (None, если это последняя).
+    """
+    def render():
+        # Авторы подгружаются в том же запросе, страница читается по индексу (book_id, created_at, id)
+        query = Review.query.options(joinedload(Review.author)).filter_by(book_id=book_id)
+        page = keyset_paginate(query, [Review.created_at, Review.id], app.config['REVIEWS_PER_PAGE'], after=after)
+        return [[[review.user_id, render_template('_review.html', review=review)] for review in page.items],
+                page.next_cursor]
+    return fragment_cache.get_or_render([book_namespace(book_id)], ['book_reviews', book_id, after], render)
 
 @app.route('/book/<int:book_id>')
 def view_book(book_id):
@@ -289,28 +320,12 @@ def view_book(book_id):
     # --- Вариант 4: Учёт истории посещений ---
     user_ip = request.remote_addr
     now = datetime.datetime.now(datetime.timezone.utc)
-    today_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
-    today_end = now
+    viewer_id = current_user.id if current_user.is_authenticated else None
 
-    # Проверяем количество просмотров сегодня для этого пользователя/IP
-    if current_user.is_authenticated:
-        view_count_today = PageView.query.filter_by(book_id=book_id, user_id=current_user.id).filter(PageView.view_time.between(today_start, today_end)).count()
-    else:
-        view_count_today = PageView.query.filter_by(book_id=book_id, ip_address=user_ip).filter(PageView.view_time.between(today_start, today_end), PageView.user_id == None).count()
-
-    if view_count_today < app.config['MAX_VIEWS_PER_DAY']:
-        new_view = PageView(
-            book_id=book.id,
-            user_id=current_user.id if current_user.is_authenticated else None,
-            view_time=now,
-            ip_address=user_ip
-        )
-        db.session.add(new_view)
-        try:
-            db.session.commit()
-        except Exception as e:
-            db.session.rollback()
-            print(f"Ошибка при сохранении просмотра: {e}") # Для дебага
+    # Лимит просмотров за сегодня для этого пользователя/IP проверяется по счётчикам в памяти, без запроса к БД.
+    # При PAGE_VIEW_BEACON просмотр присылает сама страница (POST /api/views), здесь он не записывается
+    if not app.config['PAGE_VIEW_BEACON'] and view_limiter.hit(book.id, viewer_id, user_ip, now):
+        tracking.log_view(book.id, viewer_id, user_ip, now)
 
     # Проверка, оставлял ли текущий пользователь рецензию
     user_review = None
@@ -323,19 +338,17 @@ def view_book(book_id):
         if current_user.is_authenticated and current_user.role.name in ['user', 'moderator', 'admin']:
             if not user_review: # Дополнительная проверка, чтобы не добавлять вторую рецензию
                 try:
-                    print(f"DEBUG: Содержимое review_form.text.data ДО обработки: {review_form.text.data}")
-                    # Санитизация текста рецензии
-                    sanitized_review_text = bleach.clean(markdown.markdown(review_form.text.data),
-                                                        tags=list(bleach.sanitizer.ALLOWED_TAGS) + ['p', 'br', 'em', 'strong', 'blockquote', 'code', 'pre'],
-                                                        attributes=bleach.sanitizer.ALLOWED_ATTRIBUTES)
                     new_review = Review(
                         book_id=book.id,
                         user_id=current_user.id,
-                        rating=review_form.rating.data,
-                        text=sanitized_review_text
+                        rating=review_form.rating.data
                     )
+                    rendering.set_review_text(new_review, review_form.text.data)
                     db.session.add(new_review)
+                    book.register_review(new_review.rating)
                     db.session.commit()
+                    # Рейтинг виден и в каталоге, и на странице книги
+                    fragment_cache.invalidate('catalog', book_namespace(book.id))
                     flash('Ваша рецензия успешно добавлена!', 'success')
                     return redirect(url_for('view_book', book_id=book.id))
                 except Exception as e:
@@ -348,18 +361,35 @@ def view_book(book_id):
             # Не перенаправляем на login, просто показываем сообщение и форму
             # return redirect(url_for('login')) # Или просто остаться на странице
 
-    # Все рецензии для этой книги
-    reviews = Review.query.filter_by(book_id=book.id).order_by(Review.created_at.desc()).all()
-
+    # Сведения о книге и список рецензий берутся из кэша фрагментов; своя рецензия и форма — в каждом запросе
+    namespaces = [book_namespace(book.id), 'covers']
+    book_info_html = fragment_cache.get_or_render(
+        namespaces, ['book_info', book.id, viewer_role()],
+        lambda: render_template('_book_info.html', book=book))
+    # Только первая страница рецензий: остальные подгружаются по кнопке через book_reviews
+    reviews, next_cursor = review_page(book.id)
 
     return render_template('book_detail.html',
                            book=book,
+                           book_info_html=book_info_html,
                            reviews=reviews,
+                           next_reviews_url=url_for('book_reviews', book_id=book.id, after=next_cursor) if next_cursor else None,
                            user_review=user_review,
                            review_form=review_form,
-                           markdown=markdown.markdown, # Передаем функцию для преобразования Markdown
                            title=book.title)
 
+@app.route('/book/<int:book_id>/reviews')
+def book_reviews(book_id):
+    # Следующая страница рецензий для подгрузки на странице книги: HTML карточек и кнопка «Показать ещё».
+    # Без @replica_reads: страницы кэшируются по поколению книги, и промах после новой рецензии
+    # должен читаться из основной БД, а не с отстающей реплики
+    after = request.args.get('after')
+    reviews, next_cursor = review_page(book_id, after)
+    return render_template('_review_page.html',
+                           reviews=reviews,
+                           next_reviews_url=url_for('book_reviews', book_id=book_id, after=next_cursor) if next_cursor else None,
+                           skip_user_id=current_user.id if current_user.is_authenticated else None)
+
 # --- Маршруты для рецензий (на случай, если пользователь зайдёт на форму напрямую, а не через книгу) ---
 
 @app.route('/book/<int:book_id>/add_review', methods=['GET', 'POST'])
@@ -382,17 +412,16 @@ def add_review(book_id):
     form = ReviewForm()
     if form.validate_on_submit():
         try:
-            sanitized_text = bleach.clean(markdown.markdown(form.text.data),
-                                          tags=list(bleach.sanitizer.ALLOWED_TAGS) + ['p', 'br', 'em', 'strong', 'blockquote', 'code', 'pre'],
-                                          attributes=bleach.sanitizer.ALLOWED_ATTRIBUTES)
             new_review = Review(
                 book_id=book.id,
                 user_id=current_user.id,
-                rating=form.rating.data,
-                text=sanitized_text
+                rating=form.rating.data
             )
+            rendering.set_review_text(new_review, form.text.data)
             db.session.add(new_review)
+            book.register_review(new_review.rating)
             db.session.commit()
+            fragment_cache.invalidate('catalog', book_namespace(book.id))
             flash('Ваша рецензия успешно добавлена!', 'success')
             return redirect(url_for('view_book', book_id=book.id))
         except Exception as e:
@@ -407,89 +436,92 @@ def add_review(book_id):
 
 @app.route('/statistics')
 @roles_required('admin')
+@replica_reads
 def statistics():
     active_tab = request.args.get('tab', 'journal') # По умолчанию вкладка "Журнал"
-    page_journal = request.args.get('page_journal', 1, type=int)
     page_stats = request.args.get('page_stats', 1, type=int)
+    filter_form, (date_from, date_to), filter_args = statistics_filter()
 
-    filter_form = StatisticsFilterForm(request.args)
-
-    # Журнал действий пользователей
-    journal_query = PageView.query.order_by(PageView.view_time.desc())
-    journal_pagination = journal_query.paginate(page=page_journal, per_page=app.config['PAGINATION_PER_PAGE'], error_out=False)
-
-    # Статистика просмотра книг
-    stats_query = db.session.query(
-        Book.title, func.count(PageView.id).label('view_count')
-    ).join(PageView).filter(PageView.user_id.isnot(None)) # Только аутентифицированные пользователи
+    # Журнал действий пользователей: keyset-пагинация по (view_time, id) вместо OFFSET,
+    # пользователь и книга подгружаются в том же запросе
+    journal_query = PageView.query.options(joinedload(PageView.viewer), joinedload(PageView.book))
+    journal_page = keyset_paginate(journal_query, [PageView.view_time, PageView.id], app.config['PAGINATION_PER_PAGE'],
+                                   after=request.args.get('after'), before=request.args.get('before'))
+    journal_total = exports.approximate_journal_total()
 
-    if filter_form.validate():
-        if filter_form.date_from.data:
-            from_date = datetime.strptime(filter_form.date_from.data, '%Y-%m-%d')
-            stats_query = stats_query.filter(PageView.view_time >= from_date)
-        if filter_form.date_to.data:
-            to_date = datetime.strptime(filter_form.date_to.data, '%Y-%m-%d') + timedelta(days=1, microseconds=-1) # Включительно
-            stats_query = stats_query.filter(PageView.view_time <= to_date)
-
-    stats_query = stats_query.group_by(Book.id).order_by(func.count(PageView.id).desc())
-    stats_pagination = stats_query.paginate(page=page_stats, per_page=app.config['PAGINATION_PER_PAGE'], error_out=False)
+    # Статистика просмотра книг: суммы по суточной свёртке, страницы кэшируются по (диапазон, страница)
+    stats_pagination = stats.book_view_stats_page(date_from, date_to, page_stats, app.config['PAGINATION_PER_PAGE'])
 
+    # Форма запуска фонового экспорта с текущими фильтрами
+    export_form = ExportForm(formdata=None, date_from=date_from, date_to=date_to)
 
     return render_template('statistics.html',
                            active_tab=active_tab,
-                           journal_pagination=journal_pagination,
+                           journal_page=journal_page,
+                           journal_total=journal_total,
+                           filter_args=filter_args,
                            stats_pagination=stats_pagination,
                            filter_form=filter_form,
+                           export_form=export_form,
                            title='Статистика')
 
 @app.route('/export_journal_csv')
 @roles_required('admin')
+@replica_reads
 def export_journal_csv():
-    all_views = PageView.query.order_by(PageView.view_time.desc()).all()
-    data = []
-    for i, view in enumerate(all_views):
-        user_info = view.viewer.get_full_name() if view.viewer else "Неаутентифицированный пользователь"
-        data.append([
-            i + 1,
-            user_info,
-            view.book.title if view.book else "Книга удалена", # На случай, если книга была удалена
-            view.view_time.strftime('%Y-%m-%d %H:%M:%S')
-        ])
-
-    df = pd.DataFrame(data, columns=['№', 'ФИО пользователя', 'Название книги', 'Дата и время просмотра'])
-    sio = StringIO()
-    df.to_csv(sio, index=False, encoding='utf-8')
-    output = make_response(sio.getvalue())
-    output.headers["Content-Disposition"] = f"attachment; filename=journal_actions_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
+    # Один запрос с JOIN-ами, строки читаются с сервера порциями (yield_per) и сразу уходят клиенту,
+    # поэтому расход памяти не зависит от размера журнала
+    _form, (date_from, date_to), _args = statistics_filter()
+
+    output = Response(stream_with_context(exports.csv_chunks(exports.journal_rows(date_from, date_to))), mimetype='text/csv')
+    output.headers["Content-Disposition"] = f"attachment; filename=journal_actions_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
     output.headers["Content-type"] = "text/csv; charset=utf-8"
     return output
 
 @app.route('/export_stats_csv')
 @roles_required('admin')
+@replica_reads
 def export_stats_csv():
-    filter_form = StatisticsFilterForm(request.args)
-    stats_query = db.session.query(
-        Book.title, func.count(PageView.id).label('view_count')
-    ).join(PageView).filter(PageView.user_id.isnot(None))
-
-    if filter_form.validate():
-        if filter_form.date_from.data:
-            from_date = datetime.strptime(filter_form.date_from.data, '%Y-%m-%d')
-            stats_query = stats_query.filter(PageView.view_time >= from_date)
-        if filter_form.date_to.data:
-            to_date = datetime.strptime(filter_form.date_to.data, '%Y-%m-%d') + timedelta(days=1, microseconds=-1)
-            stats_query = stats_query.filter(PageView.view_time <= to_date)
-
-    all_stats = stats_query.group_by(Book.id).order_by(func.count(PageView.id).desc()).all()
-
-    data = []
-    for i, (title, count) in enumerate(all_stats):
-        data.append([i + 1, title, count])
-
-    df = pd.DataFrame(data, columns=['№', 'Название книги', 'Количество просмотров'])
-    sio = StringIO()
-    df.to_csv(sio, index=False, encoding='utf-8')
-    output = make_response(sio.getvalue())
-    output.headers["Content-Disposition"] = f"attachment; filename=book_views_stats_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
+    _form, (date_from, date_to), _args = statistics_filter()
+
+    output = Response(stream_with_context(exports.csv_chunks(exports.stats_rows(date_from, date_to))), mimetype='text/csv')
+    output.headers["Content-Disposition"] = f"attachment; filename=book_views_stats_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
     output.headers["Content-type"] = "text/csv; charset=utf-8"
-    return output
\ No newline at end of file
+    return output
+
+# --- Фоновый экспорт: запуск, статус и скачивание готового файла ---
+
+def export_job_payload(job):
+    payload = {key: job[key] for key in ('id', 'kind', 'status', 'progress', 'total', 'cached', 'error')}
+    payload['status_url'] = url_for('export_job_status', job_id=job['id'])
+    if job['status'] == 'done':
+        payload['download_url'] = url_for('export_job_download', job_id=job['id'])
+    return payload
+
+@app.route('/exports/<kind>', methods=['POST'])
+@roles_required('admin')
+def start_export(kind):
+    if kind not in exports.EXPORT_KINDS:
+        abort(404)
+    form = ExportForm()
+    if not form.validate_on_submit():
+        return jsonify({'errors': form.errors}), 400
+    job = export_jobs.start(kind, *form.date_range(), compress=form.compress.data)
+    return jsonify(export_job_payload(job)), 202
+
+@app.route('/exports/job/<job_id>')
+@roles_required('admin')
+def export_job_status(job_id):
+    job = export_jobs.get(job_id)
+    if not job:
+        abort(404)
+    return jsonify(export_job_payload(job))
+
+@app.route('/exports/job/<job_id>/download')
+@roles_required('admin')
+def export_job_download(job_id):
+    job = export_jobs.get(job_id)
+    if not job or job['status'] != 'done' or not os.path.exists(job['path']):
+        abort(404)
+    return send_file(job['path'], as_attachment=True, download_name=export_jobs.download_name(job),
+                     mimetype='application/gzip' if job['compress'] else 'text/csv')
@@ -0,0 +1,169 @@
+# electronic_library/search.py
+# Полнотекстовый поиск по каталогу: виртуальная таблица FTS5 в SQLite
+# и FULLTEXT-индексы в MySQL. Для остальных СУБД остаётся поиск через ILIKE.
+
+import re
+from sqlalchemy import text, inspect, select, table, column, literal_column, false
+from sqlalchemy.dialects.mysql import match
+
+from extensions import db
+from models import Book, Genre
+
+FTS_TABLE = 'books_fts'
+# Облегчённое описание FTS5-таблицы: не входит в db.metadata, поэтому create_all её не трогает
+books_fts = table(FTS_TABLE, column('rowid'), column('rank'))
+
+# FULLTEXT-индексы MySQL: MATCH() требует индекс ровно по тому же набору колонок
+MYSQL_FULLTEXT_INDEXES = {
+    'ix_books_fulltext_title': ('title',),
+    'ix_books_fulltext_author': ('author',),
+    'ix_books_fulltext_all': ('title', 'author', 'publisher', 'short_description'),
+}
+
+_WORD_RE = re.compile(r'\w+', re.UNICODE)
+_TAG_RE = re.compile(r'<[^>]+>')
+
+_backend = None  # Определяется один раз на процесс
+
+
+def _detect_backend():
+    dialect = db.engine.dialect.name
+    if dialect == 'sqlite':
+        tables = inspect(db.engine).get_table_names()
+        return 'fts5' if FTS_TABLE in tables else None
+    if dialect == 'mysql':
+        indexes = {index['name'] for index in inspect(db.engine).get_indexes(Book.__tablename__)}
+        return 'fulltext' if set(MYSQL_FULLTEXT_INDEXES) <= indexes else None
+    return None
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        _backend = _detect_backend() or 'like'
+    return _backend
+
+
+def _words(value):
+    return _WORD_RE.findall(value or '')
+
+
+def _plain_description(book):
+    # В FTS попадает текст без HTML-разметки
+    return _TAG_RE.sub(' ', book.short_description or '')
+
+
+def ensure_search_index():
+    """Создаёт поисковый индекс для текущей СУБД и заполняет его."""
+    global _backend
+    dialect = db.engine.dialect.name
+    if dialect == 'sqlite':
+        db.session.execute(text(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} "
+            "USING fts5(title, author, publisher, description, tokenize='unicode61 remove_diacritics 2')"
+        ))
+        rebuild_search_index()
+    elif dialect == 'mysql':
+        existing = {index['name'] for index in inspect(db.engine).get_indexes(Book.__tablename__)}
+        for name, columns in MYSQL_FULLTEXT_INDEXES.items():
+            if name not in existing:
+                db.session.execute(text(f"CREATE FULLTEXT INDEX {name} ON {Book.__tablename__} ({', '.join(columns)})"))
+    _backend = None
+
+
+def rebuild_search_index():
+    """Полностью перестраивает FTS5-таблицу по содержимому books."""
+    if db.engine.dialect.name != 'sqlite':
+        return
+    db.session.execute(text(f'DELETE FROM {FTS_TABLE}'))
+    for book in Book.query.yield_per(500):
+        _insert_row(book)
+
+
+def _insert_row(book):
+    db.session.execute(
+        text(f'INSERT INTO {FTS_TABLE} (rowid, title, author, publisher, description) '
+             'VALUES (:id, :title, :author, :publisher, :description)'),
+        {'id': book.id, 'title': book.title, 'author': book.author,
+         'publisher': book.publisher, 'description': _plain_description(book)}
+    )
+
+
+def index_book(book):
+    # Вызывается внутри транзакции add_book/edit_book, поэтому индекс откатывается вместе с книгой.
+    # MySQL поддерживает FULLTEXT-индексы сам.
+    if get_backend() != 'fts5':
+        return
+    remove_book(book.id)
+    _insert_row(book)
+
+
+def remove_book(book_id):
+    if get_backend() != 'fts5':
+        return
+    db.session.execute(text(f'DELETE FROM {FTS_TABLE} WHERE rowid = :id'), {'id': book_id})
+
+
+def _fts5_query(fields):
+    # title : ("шерл"* "хол"*) AND author : ("дой"*) — префиксный поиск по каждому слову
+    parts = []
+    for name, value in fields.items():
+        words = _words(value)
+        if words:
+            parts.append(f'{name} : (' + ' '.join(f'"{word}"*' for word in words) + ')')
+    return ' AND '.join(parts)
+
+
+def apply_text_search(query, title=None, author=None):
+    """Добавляет к запросу книг фильтр по названию/автору.
+
+    Возвращает пару (query, rank), где rank — выражение для сортировки по
+    релевантности или None, если ранжирование недоступно.
+    """
+    fields = {name: value for name, value in (('title', title), ('author', author)) if value}
+    if not fields:
+        return query, None
+
+    backend = get_backend()
+    if backend in ('fts5', 'fulltext') and not all(_words(value) for value in fields.values()):
+        # Поле только из знаков препинания (?title=!!!) не даёт слов для индекса: ничего не найдено,
+        # а не весь каталог без фильтра
+        return query.filter(false()), None
+
+    if backend == 'fts5':
+        match_query = _fts5_query(fields)
+        hits = select(books_fts.c.rowid.label('book_id'), books_fts.c.rank.label('rank')) \
+            .where(literal_column(FTS_TABLE).op('MATCH')(match_query)).subquery()
+        # rank в FTS5 — это bm25: чем меньше значение, тем релевантнее
+        return query.join(hits, hits.c.book_id == Book.id), hits.c.rank.asc()
+
+    if backend == 'fulltext':
+        scores = []
+        for name, value in fields.items():
+            score = match(getattr(Book, name), against=' '.join(f'+{word}*' for word in _words(value))).in_boolean_mode()
+            query = query.filter(score > 0)
+            scores.append(score)
+        return query, sum(scores[1:], scores[0]).desc()
+
+    for name, value in fields.items():
+        query = query.filter(getattr(Book, name).ilike(f'%{value}%'))
+    return query, None
+
+
+def filter_books(query, filter_args):
+    """Применяет фильтры каталога (BookSearchForm.filter_args()) к запросу книг.
+
+    Возвращает пару (query, rank), как apply_text_search.
+    """
+    # Название и автор ищутся через полнотекстовый индекс (префиксный поиск с ранжированием)
+    query, rank = apply_text_search(query, title=filter_args.get('title'), author=filter_args.get('author'))
+    if 'genres' in filter_args:
+        # EXISTS по связи many-to-many: книга с несколькими подходящими жанрами не дублируется
+        query = query.filter(Book.genres.any(Genre.id.in_(filter_args['genres'])))
+    if 'publication_year' in filter_args:
+        query = query.filter(Book.publication_year.in_(filter_args['publication_year']))
+    if 'pages_from' in filter_args:
+        query = query.filter(Book.pages >= filter_args['pages_from'])
+    if 'pages_to' in filter_args:
+        query = query.filter(Book.pages <= filter_args['pages_to'])
+    return query, rank
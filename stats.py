@@ -0,0 +1,119 @@
+# electronic_library/stats.py
+# Статистика просмотров книг аутентифицированными пользователями (вкладка "Статистика" и экспорт).
+# Считается по суточной свёртке book_view_daily, поэтому стоимость отчёта зависит от числа
+# книг и дней в диапазоне, а не от числа сырых просмотров.
+
+from datetime import datetime, timezone
+from math import ceil
+from sqlalchemy import func
+
+from extensions import db
+from app import app
+from models import Book, BookViewDaily
+from cache import TTLCache
+from fragments import fragment_cache
+
+# Поколение пространства имён в fragment_cache входит в ключ: invalidate() с бэкендом 'sqlite'
+# видят все воркеры и CLI-команды, с бэкендом 'memory' — только свой воркер, поэтому тогда
+# сроки ниже урезаются до FRAGMENT_CACHE_SECONDS (fragment_cache.local_ttl)
+NAMESPACE = 'stats'
+
+# Просмотры за полностью закрытые дни не меняются, но названия книг могут: такие результаты живут
+# до STATS_CLOSED_CACHE_SECONDS, диапазоны с текущими сутками — не дольше STATS_CACHE_SECONDS
+_closed_cache = TTLCache(maxsize=256, ttl=fragment_cache.local_ttl(app.config['STATS_CLOSED_CACHE_SECONDS']))
+_open_cache = TTLCache(maxsize=64, ttl=fragment_cache.local_ttl(app.config['STATS_CACHE_SECONDS']))
+
+
+class StatsPage:
+    """Страница статистики с тем же интерфейсом, что и пагинация Flask-SQLAlchemy в шаблоне."""
+
+    def __init__(self, items, page, per_page, total):
+        self.items = items
+        self.page = page
+        self.per_page = per_page
+        self.total = total
+
+    @property
+    def pages(self):
+        return max(ceil(self.total / self.per_page), 1) if self.per_page else 1
+
+    @property
+    def has_prev(self):
+        return self.page > 1
+
+    @property
+    def prev_num(self):
+        return self.page - 1 if self.has_prev else None
+
+    @property
+    def has_next(self):
+        return self.page < self.pages
+
+    @property
+    def next_num(self):
+        return self.page + 1 if self.has_next else None
+
+    def iter_pages(self, left_edge=2, left_current=2, right_current=4, right_edge=2):
+        last = 0
+        for num in range(1, self.pages + 1):
+            if (num <= left_edge
+                    or self.page - left_current <= num <= self.page + right_current
+                    or num > self.pages - right_edge):
+                if last + 1 != num:
+                    yield None
+                yield num
+                last = num
+
+
+DATE_FORMAT = '%Y-%m-%d'
+
+
+def parse_day(value):
+    """Дата из строки ГГГГ-ММ-ДД (границы фильтра статистики и экспорта); None для пустой строки.
+
+    Неверный формат — ValueError (его показывает форма DateRangeForm).
+    """
+    return datetime.strptime(value, DATE_FORMAT).date() if value else None
+
+
+def stats_query(date_from=None, date_to=None):
+    """(название книги, просмотры) по убыванию просмотров; границы — строки ГГГГ-ММ-ДД включительно."""
+    views = func.sum(BookViewDaily.authenticated_views)
+    query = db.session.query(Book.title, views.label('view_count')) \
+        .join(BookViewDaily, BookViewDaily.book_id == Book.id)
+    if date_from:
+        query = query.filter(BookViewDaily.day >= parse_day(date_from))
+    if date_to:
+        query = query.filter(BookViewDaily.day <= parse_day(date_to))
+    # Книги, которые смотрели только гости, в статистику не попадают
+    return query.group_by(Book.id, Book.title).having(views > 0).order_by(views.desc(), Book.id)
+
+
+def stats_total(date_from=None, date_to=None):
+    return stats_query(date_from, date_to).order_by(None).count()
+
+
+def book_view_stats_page(date_from, date_to, page, per_page):
+    today = datetime.now(timezone.utc).date()
+    to_day = parse_day(date_to)
+    generation = fragment_cache.generation(NAMESPACE)
+    if to_day is not None and to_day < today:
+        cache, key = _closed_cache, (generation, date_from, date_to, page, per_page)
+    else:
+        # Текущие сутки ещё не закрыты: день входит в ключ, поэтому после полуночи запись не используется
+        cache, key = _open_cache, (generation, date_from, date_to, page, per_page, today)
+
+    def load():
+        page_number = max(page, 1)
+        # Сразу после invalidate() результат под новым поколением читается из основной БД
+        with fragment_cache.fresh_reads([NAMESPACE]):
+            items = [tuple(row) for row in stats_query(date_from, date_to)
+                     .limit(per_page).offset((page_number - 1) * per_page)]
+            return StatsPage(items, page_number, per_page, stats_total(date_from, date_to))
+
+    return cache.get_or_set(key, load)
+
+
+def invalidate():
+    """Сбрасывает кэш (после изменения или удаления книги и пересчёта свёртки) во всех воркерах."""
+    fragment_cache.invalidate(NAMESPACE)
@@ -0,0 +1,95 @@
+# electronic_library/tests/test_catalog_queries.py
+# Число SQL-запросов при рендере каталога не должно зависеть от количества книг:
+# обложки, жанры и рейтинги загружаются пачкой (Book.listing_options), а не по книге (N+1).
+
+import os
+import tempfile
+from datetime import datetime, timedelta, timezone
+
+# Настройки читаются при импорте приложения, поэтому временная БД задаётся до него
+_tmp_dir = tempfile.mkdtemp()
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(_tmp_dir, 'test.db')
+
+import pytest
+from sqlalchemy import event
+
+from app import app
+from extensions import db
+from models import Role, User, Genre, Book, Cover, Review, PageView, BookViewDaily
+import tracking
+from refdata import reference_data
+from fragments import fragment_cache
+
+# Каталог, популярные книги (ID из свёртки + книги), недавно просмотренные, справочник жанров и годов
+MAX_CATALOG_STATEMENTS = 10
+
+
+@pytest.fixture
+def client():
+    app.config['FRAGMENT_CACHE_SECONDS'] = 0  # Каталог рендерится в каждом запросе, а не берётся из кэша
+    # Служебные файлы SQLite — во временном каталоге, а не в instance/
+    app.config['FRAGMENT_CACHE_DB'] = os.path.join(_tmp_dir, 'fragments.db')
+    app.config['VIEW_LIMIT_DB'] = os.path.join(_tmp_dir, 'view_limits.db')
+    fragment_cache.reset()
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        role = Role(name='user')
+        db.session.add(role)
+        db.session.flush()
+        db.session.add(User(login='reader', password_hash='-', last_name='Тестов', first_name='Читатель', role_id=role.id))
+        db.session.add_all([Genre(name='Роман'), Genre(name='Фантастика')])
+        db.session.commit()
+    yield app.test_client()
+    with app.app_context():
+        db.session.remove()
+        db.drop_all()
+
+
+def add_books(count):
+    """Книги с обложкой, двумя жанрами, рецензией, просмотрами и историей просмотров гостя."""
+    now = datetime.now(timezone.utc)
+    with app.app_context():
+        genres = Genre.query.all()
+        user = User.query.first()
+        start = Book.query.count()
+        for i in range(start, start + count):
+            cover = Cover(filename=f'{i:032x}.png', mime_type='image/png', md5_hash=f'{i:032x}')
+            book = Book(title=f'Книга {i}', short_description='<p>-</p>', publication_year=1900 + i,
+                        publisher='Издательство', author=f'Автор {i}', pages=100 + i, cover=cover, genres=genres)
+            db.session.add(book)
+            db.session.flush()
+            db.session.add(Review(book_id=book.id, user_id=user.id, rating=4, text='<p>-</p>'))
+            book.register_review(4)
+            db.session.add(PageView(book_id=book.id, ip_address='127.0.0.1', view_time=now - timedelta(minutes=i)))
+            db.session.add(BookViewDaily(book_id=book.id, day=now.date(), views=i + 1, authenticated_views=0))
+        db.session.commit()
+
+
+def catalog_statements(client):
+    # Кэши воркера сбрасываются, чтобы каждый замер включал все запросы рендера
+    tracking.reset_popular_cache()
+    with app.app_context():
+        reference_data.invalidate()
+        engine = db.engine
+    statements = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, 'before_cursor_execute', count)
+    try:
+        response = client.get('/')
+    finally:
+        event.remove(engine, 'before_cursor_execute', count)
+    assert response.status_code == 200
+    return len(statements)
+
+
+def test_catalog_statement_count_does_not_grow_with_books(client):
+    add_books(3)
+    small = catalog_statements(client)
+    add_books(app.config['PAGINATION_PER_PAGE'] * 2)
+    large = catalog_statements(client)
+    assert small <= MAX_CATALOG_STATEMENTS
+    assert large == small
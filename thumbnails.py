@@ -0,0 +1,129 @@
+# electronic_library/thumbnails.py
+# Уменьшенные копии обложек для каталога и страницы книги. Для каждой обложки создаются
+# JPEG (и при поддержке Pillow — WebP) шириной COVER_THUMBNAIL_WIDTHS; шаблоны выбирают
+# подходящую через srcset, поэтому в карточку каталога не попадает исходный многомегабайтный PNG.
+# Файлы называются по MD5 обложки: общие обложки делят и уменьшенные копии.
+
+import os
+import threading
+from flask import url_for
+
+from extensions import db
+from app import app
+from models import Cover
+from fragments import fragment_cache
+from workers import ForkSafeExecutor
+
+FALLBACK_FORMAT = 'jpg'
+SAVE_OPTIONS = {
+    'jpg': {'format': 'JPEG', 'quality': 82, 'optimize': True, 'progressive': True},
+    'webp': {'format': 'WEBP', 'quality': 80, 'method': 4},
+}
+
+
+_webp_supported = None
+
+
+def webp_enabled():
+    global _webp_supported
+    if _webp_supported is None:
+        from PIL import features  # Pillow нужен только при построении копий, не при запуске воркера
+        _webp_supported = features.check('webp')
+    return app.config['COVER_THUMBNAIL_WEBP'] and _webp_supported
+
+
+def thumbnail_formats():
+    return [FALLBACK_FORMAT, 'webp'] if webp_enabled() else [FALLBACK_FORMAT]
+
+
+def thumbnail_name(md5_hash, width, fmt):
+    return f'{md5_hash}_{width}.{fmt}'
+
+
+def thumbnail_path(md5_hash, width, fmt):
+    return os.path.join(app.config['THUMBNAIL_FOLDER'], thumbnail_name(md5_hash, width, fmt))
+
+
+def _flatten(image):
+    from PIL import Image
+    # JPEG не поддерживает прозрачность: подкладываем белый фон
+    if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image.convert('RGB')
+
+
+def render_thumbnails(source_path, md5_hash):
+    """Создаёт все уменьшенные копии файла; каждая записывается атомарно через временный файл."""
+    from PIL import Image
+    os.makedirs(app.config['THUMBNAIL_FOLDER'], exist_ok=True)
+    with Image.open(source_path) as original:
+        original.load()
+        image = _flatten(original)
+    for width in app.config['COVER_THUMBNAIL_WIDTHS']:
+        resized = image.copy()
+        # Исходник уже меньше нужной ширины — сохраняем как есть, без увеличения
+        resized.thumbnail((width, width * 4), Image.LANCZOS)
+        for fmt in thumbnail_formats():
+            path = thumbnail_path(md5_hash, width, fmt)
+            tmp_path = f'{path}.{threading.get_ident()}.tmp'
+            resized.save(tmp_path, **SAVE_OPTIONS[fmt])
+            os.replace(tmp_path, path)
+
+
+def build_thumbnails(cover_id):
+    """Строит копии для обложки и отмечает её готовой. Возвращает True при успехе."""
+    with app.app_context():
+        try:
+            cover = db.session.get(Cover, cover_id)
+            if cover is None:
+                return False
+            render_thumbnails(os.path.join(app.config['UPLOAD_FOLDER'], cover.filename), cover.md5_hash)
+            db.session.execute(db.update(Cover).where(Cover.id == cover_id).values(thumbnails_ready=True))
+            db.session.commit()
+            # Закэшированные страницы ещё ссылаются на оригинал обложки
+            fragment_cache.invalidate('catalog', 'covers')
+            return True
+        except Exception as e:
+            db.session.rollback()
+            app.logger.error(f'Не удалось построить миниатюры обложки {cover_id}: {e}')
+            return False
+        finally:
+            db.session.remove()
+
+
+def remove_thumbnails(md5_hash):
+    for width in app.config['COVER_THUMBNAIL_WIDTHS']:
+        for fmt in SAVE_OPTIONS:
+            path = thumbnail_path(md5_hash, width, fmt)
+            if os.path.exists(path):
+                os.remove(path)
+
+
+class ThumbnailWorkers:
+    """Пул потоков для построения миниатюр после загрузки, чтобы запрос не ждал Pillow."""
+
+    def __init__(self, app):
+        self._pool = ForkSafeExecutor(app, 'COVER_THUMBNAIL_WORKERS', 'thumbnail')
+
+    def submit(self, cover_id):
+        return self._pool.submit(build_thumbnails, cover_id)
+
+
+thumbnail_workers = ThumbnailWorkers(app)
+
+
+@app.template_global()
+def cover_thumbnail_url(cover, width, fmt=FALLBACK_FORMAT):
+    return url_for('cover_thumbnail', filename=thumbnail_name(cover.md5_hash, width, fmt))
+
+
+@app.template_global()
+def cover_srcset(cover, fmt=FALLBACK_FORMAT):
+    """Значение srcset ('url 120w, url 240w, ...'); пустая строка, если копий нет или формат отключён."""
+    if not cover.thumbnails_ready or fmt not in thumbnail_formats():
+        return ''
+    return ', '.join(f'{cover_thumbnail_url(cover, width, fmt)} {width}w'
+                     for width in app.config['COVER_THUMBNAIL_WIDTHS'])
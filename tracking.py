@@ -0,0 +1,196 @@
+# electronic_library/tracking.py
+# Учёт просмотров книг (Вариант 4): запись PageView и поддержка суточной свёртки book_view_daily
+
+import atexit
+import os
+import threading
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import func, case, insert
+from sqlalchemy.dialects import sqlite, mysql
+
+from extensions import db
+from app import app
+from models import PageView, BookViewDaily
+from cache import TTLCache
+
+_popular_cache = TTLCache(maxsize=8, ttl=app.config['POPULAR_BOOKS_CACHE_SECONDS'])
+
+
+def _upsert_statement():
+    table = BookViewDaily.__table__
+    dialect = db.engine.dialect.name
+    if dialect == 'sqlite':
+        stmt = sqlite.insert(table)
+        return stmt.on_conflict_do_update(
+            index_elements=[table.c.book_id, table.c.day],
+            set_={'views': table.c.views + stmt.excluded.views,
+                  'authenticated_views': table.c.authenticated_views + stmt.excluded.authenticated_views})
+    if dialect == 'mysql':
+        stmt = mysql.insert(table)
+        return stmt.on_duplicate_key_update(
+            views=table.c.views + stmt.inserted.views,
+            authenticated_views=table.c.authenticated_views + stmt.inserted.authenticated_views)
+    return None
+
+
+def bump_daily_views(rows):
+    """Увеличивает счётчики свёртки. rows — список словарей book_id/day/views/authenticated_views."""
+    if not rows:
+        return
+    stmt = _upsert_statement()
+    if stmt is not None:
+        db.session.execute(stmt, rows)
+        return
+    # Запасной вариант для СУБД без UPSERT
+    for row in rows:
+        daily = db.session.get(BookViewDaily, (row['book_id'], row['day']))
+        if daily is None:
+            db.session.add(BookViewDaily(**row))
+        else:
+            daily.views += row['views']
+            daily.authenticated_views += row['authenticated_views']
+
+
+def _daily_rows(views):
+    counts = Counter()
+    authenticated = Counter()
+    for view in views:
+        key = (view['book_id'], view['view_time'].date())
+        counts[key] += 1
+        if view['user_id'] is not None:
+            authenticated[key] += 1
+    return [{'book_id': book_id, 'day': day, 'views': views_count, 'authenticated_views': authenticated[(book_id, day)]}
+            for (book_id, day), views_count in counts.items()]
+
+
+def record_view(book_id, user_id, ip_address, view_time):
+    """Добавляет просмотр в текущую транзакцию вместе с обновлением свёртки."""
+    db.session.add(PageView(book_id=book_id, user_id=user_id, view_time=view_time, ip_address=ip_address))
+    bump_daily_views(_daily_rows([{'book_id': book_id, 'user_id': user_id, 'view_time': view_time}]))
+
+
+class ViewRecorder:
+    """Отложенная (write-behind) запись просмотров.
+
+    Просмотры складываются в буфер процесса, а фоновый поток пишет их пачками
+    (один executemany INSERT + один UPSERT свёртки) по достижении
+    PAGE_VIEW_FLUSH_SIZE записей или раз в PAGE_VIEW_FLUSH_INTERVAL секунд.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._buffer = []
+        self._cond = threading.Condition()
+        self._thread = None
+        self._pid = None
+        self._stopping = False
+
+    def _ensure_thread(self):
+        # Поток запускается лениво и заново после fork (gunicorn --preload)
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        self._pid = os.getpid()
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name='page-view-recorder', daemon=True)
+        self._thread.start()
+
+    def enqueue(self, book_id, user_id, ip_address, view_time):
+        with self._cond:
+            self._ensure_thread()
+            self._buffer.append({'book_id': book_id, 'user_id': user_id,
+                                 'ip_address': ip_address, 'view_time': view_time})
+            if len(self._buffer) >= self.app.config['PAGE_VIEW_FLUSH_SIZE']:
+                self._cond.notify()
+
+    def _run(self):
+        interval = self.app.config['PAGE_VIEW_FLUSH_INTERVAL']
+        while True:
+            with self._cond:
+                if not self._stopping and len(self._buffer) < self.app.config['PAGE_VIEW_FLUSH_SIZE']:
+                    self._cond.wait(timeout=interval)
+                stopping = self._stopping
+            self.flush()
+            if stopping:
+                return
+
+    def flush(self):
+        with self._cond:
+            batch, self._buffer = self._buffer, []
+        if not batch:
+            return 0
+        with self.app.app_context():
+            try:
+                db.session.execute(insert(PageView), batch)
+                bump_daily_views(_daily_rows(batch))
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                self.app.logger.error(f'Не удалось записать {len(batch)} просмотров: {e}')
+        return len(batch)
+
+    def stop(self):
+        """Останавливает фоновый поток и дописывает остаток буфера (вызывается при завершении воркера)."""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+            thread = self._thread if self._pid == os.getpid() else None
+        if thread is not None:
+            thread.join(timeout=10)
+        self.flush()
+
+
+recorder = ViewRecorder(app)
+atexit.register(recorder.stop)
+
+
+def log_view(book_id, user_id, ip_address, view_time):
+    """Фиксирует просмотр в режиме PAGE_VIEW_RECORDING: 'sync' — сразу, 'buffered' — через буфер."""
+    if app.config['PAGE_VIEW_RECORDING'] == 'buffered':
+        recorder.enqueue(book_id, user_id, ip_address, view_time)
+        return
+    record_view(book_id, user_id, ip_address, view_time)
+    try:
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        app.logger.error(f'Ошибка при сохранении просмотра: {e}')
+
+
+def rebuild_daily_views():
+    """Пересчитывает book_view_daily целиком по сырым page_views."""
+    db.session.query(BookViewDaily).delete()
+    day = func.date(PageView.view_time)
+    aggregated = db.select(
+        PageView.book_id,
+        day,
+        func.count(PageView.id),
+        func.sum(case((PageView.user_id.isnot(None), 1), else_=0)),
+    ).group_by(PageView.book_id, day)
+    result = db.session.execute(insert(BookViewDaily).from_select(
+        ['book_id', 'day', 'views', 'authenticated_views'], aggregated))
+    reset_popular_cache()
+    return result.rowcount
+
+
+def reset_popular_cache():
+    """Сбрасывает кэш ID популярных книг этого процесса (после пересчёта свёртки и в тестах)."""
+    _popular_cache.clear()
+
+
+def popular_book_ids(limit=5):
+    """ID самых просматриваемых книг за скользящее окно POPULAR_BOOKS_PERIOD_MONTHS (из свёртки)."""
+    today = datetime.now(timezone.utc).date()
+    since = today - timedelta(days=30 * app.config['POPULAR_BOOKS_PERIOD_MONTHS'])
+
+    def load():
+        total = func.sum(BookViewDaily.views)
+        rows = db.session.query(BookViewDaily.book_id, total) \
+            .filter(BookViewDaily.day >= since) \
+            .group_by(BookViewDaily.book_id) \
+            .order_by(total.desc(), BookViewDaily.book_id) \
+            .limit(limit).all()
+        return [book_id for book_id, views in rows]
+
+    # Окно сдвигается раз в сутки, поэтому день входит в ключ кэша
+    return _popular_cache.get_or_set((since, limit), load)
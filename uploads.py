@@ -0,0 +1,57 @@
+# electronic_library/uploads.py
+# Приём загружаемых файлов: содержимое копируется во временный файл в UPLOAD_FOLDER
+# порциями по UPLOAD_CHUNK_SIZE с одновременным подсчётом MD5. В памяти в каждый момент
+# находится не больше одной порции, а файл читается из запроса ровно один раз.
+
+import hashlib
+import os
+import tempfile
+
+from app import app
+
+
+class StagedUpload:
+    """Загруженный файл, записанный во временный файл рядом с обложками."""
+
+    def __init__(self, tmp_path, md5_hash, size):
+        self.tmp_path = tmp_path
+        self.md5_hash = md5_hash
+        self.size = size
+
+    def commit(self, filename):
+        """Атомарно переименовывает временный файл в постоянный (та же файловая система)."""
+        path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+        os.replace(self.tmp_path, path)
+        self.tmp_path = None
+        return path
+
+    def discard(self):
+        """Удаляет временный файл (дубликат уже есть на диске или транзакция откатилась)."""
+        if self.tmp_path and os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+        self.tmp_path = None
+
+
+def stage_upload(file):
+    """Копирует FileStorage во временный файл, считая MD5 по ходу чтения. Пустой файл — ValueError."""
+    folder = app.config['UPLOAD_FOLDER']
+    os.makedirs(folder, exist_ok=True)
+    chunk_size = app.config['UPLOAD_CHUNK_SIZE']
+    md5 = hashlib.md5()
+    size = 0
+    fd, tmp_path = tempfile.mkstemp(prefix='.upload_', suffix='.tmp', dir=folder)
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            while True:
+                chunk = file.stream.read(chunk_size)
+                if not chunk:
+                    break
+                md5.update(chunk)
+                out.write(chunk)
+                size += len(chunk)
+        if not size:
+            raise ValueError("Загруженный файл пуст.")
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    return StagedUpload(tmp_path, md5.hexdigest(), size)
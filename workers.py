@@ -0,0 +1,33 @@
+# electronic_library/workers.py
+# Пулы фоновых потоков внутри воркера (миниатюры обложек, экспорт CSV).
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class ForkSafeExecutor:
+    """ThreadPoolExecutor, который создаётся при первой задаче и заново после fork.
+
+    Потоки пула в дочерний процесс не переходят, поэтому пул, созданный в мастере gunicorn
+    (preload_app), в воркере пересоздаётся. Размер пула читается из app.config[size_key].
+    """
+
+    def __init__(self, app, size_key, thread_name_prefix):
+        self.app = app
+        self.size_key = size_key
+        self.thread_name_prefix = thread_name_prefix
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def executor(self):
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ThreadPoolExecutor(max_workers=self.app.config[self.size_key],
+                                                    thread_name_prefix=self.thread_name_prefix)
+                self._pid = os.getpid()
+            return self._executor
+
+    def submit(self, fn, *args):
+        return self.executor().submit(fn, *args)